@@ -0,0 +1,55 @@
+import argparse
+import json
+import logging
+import os
+import sys
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(BENCHMARKS, '..', 'src')
+sys.path.insert(0, SRC)
+
+from services.bundle import Bundle  # noqa: E402
+from services.calibration import best, fit  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reports the Expand calibration that building the bundle fits.')
+    parser.add_argument('--samples', type=int, default=1_000)
+    parser.add_argument('--holdout', type=float, default=0.1, help='share of beyts left out of the index')
+    parser.add_argument('--edit-weights', default='1,2,3,4,6,8')
+    parser.add_argument('--beam', type=int, default=int(os.getenv('EXPANSION_BEAM', 8)))
+    parser.add_argument('--candidates', type=int, default=int(os.getenv('EXPANSION_CANDIDATES', 5)))
+    parser.add_argument('--smoothing', type=float, default=float(os.getenv('EXPANSION_SMOOTHING', 50.0)))
+    parser.add_argument('--rewrites', type=int, default=int(os.getenv('EXPANSION_REWRITES', 3)))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='write the results as json to this path')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    os.chdir(os.path.join(BENCHMARKS, '..'))
+
+    texts = Bundle().corpus('resources/shahnameh-labeled.csv')['text'].tolist()
+    results = fit(texts, args.beam, args.candidates, args.smoothing, args.rewrites,
+                  [float(w) for w in args.edit_weights.split(',')], args.samples, args.holdout, args.seed)
+    for r in results:
+        logger.info(f'edit weight {r["edit_weight"]:g}: {json.dumps(r)}')
+    chosen = best(results)
+
+    print(f'{"edit weight":>12}{"temperature":>13}{"outside":>9}{"acc@1":>8}{f"acc@{args.rewrites}":>8}'
+          f'{"ece":>8}{"softmax ece":>13}')
+    for r in results:
+        print(f'{r["edit_weight"]:>12g}{r["temperature"]:>13.3f}{r["outside"]:>9.2f}'
+              f'{r["calibrated"]["accuracy@1"]:>8.3f}{r["calibrated"][f"accuracy@{args.rewrites}"]:>8.3f}'
+              f'{r["calibrated"]["ece"]:>8.3f}{r["uncalibrated"]["ece"]:>13.3f}')
+    print(f'EXPANSION_EDIT_WEIGHT={chosen["edit_weight"]:g} EXPANSION_TEMPERATURE={chosen["temperature"]:.3f} '
+          f'EXPANSION_OUTSIDE={chosen["outside"]:.2f}')
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'config': vars(args), 'results': results}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
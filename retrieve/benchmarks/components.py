@@ -0,0 +1,269 @@
+import argparse
+import json
+import logging
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(BENCHMARKS, '..', 'src')
+RESOURCES = os.path.join(BENCHMARKS, '..', 'resources')
+sys.path.insert(0, SRC)
+
+from services.bundle import Bundle  # noqa: E402
+from services.clustring import Clustering  # noqa: E402
+from services.link_analysis import LinkDocumentsAnalyzer  # noqa: E402
+from services.registry import PARSBERT, registry  # noqa: E402
+from services.similarities import Similarities  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+WORD2VEC = 'resources/farsi_literature_word2vec_model.txt'
+QUERY_METHODS = ['get_similar_by_tfidf', 'get_similar_by_boolean',
+                 'get_similar_by_word_embedding', 'get_similar_by_sentence_embedding']
+
+
+class HashingEncoder:
+    # stands in for ParsBERT when the corpus is too large to encode; every token gets a fixed random vector
+
+    def __init__(self, hidden_size=768, seed=0):
+        self.hidden_size = hidden_size
+        self.seed = seed
+        self.vocabulary = {}
+        self.vectors = np.zeros((0, hidden_size), dtype=np.float32)
+
+    def token_ids(self, tokens):
+        new = [t for t in dict.fromkeys(tokens) if t not in self.vocabulary]
+        if new:
+            base = len(self.vocabulary)
+            self.vocabulary.update((t, base + i) for i, t in enumerate(new))
+            rng = np.random.default_rng([self.seed, len(self.vectors)])
+            self.vectors = np.vstack([self.vectors, rng.normal(size=(len(new), self.hidden_size)).astype(np.float32)])
+
+        return [self.vocabulary[t] for t in tokens]
+
+    def encode(self, texts):
+        tokens = [text.split() or [''] for text in texts]
+        lengths = np.array([len(t) for t in tokens])
+        ids = self.token_ids([t for text in tokens for t in text])
+
+        offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        return np.add.reduceat(self.vectors[ids], offsets) / lengths[:, None]
+
+
+def synthetic_word2vec(words, size=100, seed=0):
+    from gensim.models import KeyedVectors
+
+    vectors = KeyedVectors(size)
+    vectors.add_vectors(words, np.random.default_rng(seed).normal(size=(len(words), size)).astype(np.float32))
+    return vectors
+
+
+def synthetic_corpus(df, names, scale, seed=0, mention_rate=0.05):
+    # beyts with the real length distribution and word frequencies; some mention a character so the graph is not empty
+    rng = np.random.default_rng(seed)
+    mesras = [m.strip() for text in df['text'] for m in text.split('-', 1)]
+    tokens = [m.split() for m in mesras]
+
+    words, counts = np.unique([w for m in tokens for w in m], return_counts=True)
+    lengths = np.array([len(m) for m in tokens])
+    n = int(len(df) * scale)
+
+    def mesra(length, mention):
+        picked = list(rng.choice(words, size=length, p=counts / counts.sum()))
+        if mention:
+            picked[rng.integers(length)] = rng.choice(names)
+        return ' '.join(picked)
+
+    sizes = rng.choice(lengths, size=(n, 2))
+    mentions = rng.random(n) < mention_rate
+    return pd.DataFrame({
+        'text': [f'{mesra(a, m)} - {mesra(b, False)}' for (a, b), m in zip(sizes, mentions)],
+        'labels': rng.choice(df['labels'].unique(), size=n),
+    })
+
+
+def measure(fn, memory):
+    if memory:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - start
+
+    peak = None
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return result, {'seconds': seconds, 'peak_bytes': peak}
+
+
+class StepStore:
+    # forwards to a store and closes a step on every write: the time and peak memory since the previous write go to
+    # the artifact written, so a constructor that builds several artifacts is reported one step per artifact
+
+    def __init__(self, store, prefix, results, memory):
+        self.store = store
+        self.prefix = prefix
+        self.results = results
+        self.memory = memory
+        self.last = None
+
+    def __enter__(self):
+        if self.memory:
+            tracemalloc.start()
+        self.last = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        if self.memory:
+            tracemalloc.stop()
+
+    def __contains__(self, name):
+        return name in self.store
+
+    def load(self, name):
+        return self.store.load(name)
+
+    def save(self, name, array):
+        self.store.save(name, array)
+
+        step = self.results.setdefault(f'{self.prefix}.{name.split(".")[0]}', {'seconds': 0.0, 'peak_bytes': None})
+        step['seconds'] += time.perf_counter() - self.last
+        if self.memory:
+            step['peak_bytes'] = max(step['peak_bytes'] or 0, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+
+        self.last = time.perf_counter()
+
+
+def measure_queries(fn, queries, memory):
+    # latencies are taken untraced, then one extra traced call gives the peak memory of a single query;
+    # the query cache is emptied first so that call encodes again instead of hitting the untraced run
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        fn(query)
+        latencies.append(time.perf_counter() - start)
+
+    registry.query_cache.clear()
+    _, traced = measure(lambda: fn(queries[0]), memory)
+    latencies = np.array(latencies) * 1e3
+    return {
+        'seconds': float(latencies.sum() / 1e3),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'peak_bytes': traced['peak_bytes'],
+    }
+
+
+def run_scale(df, chars, scale, queries, args):
+    results = {}
+    directory = tempfile.mkdtemp(prefix=f'bench-{scale}x-')
+    try:
+        corpus = synthetic_corpus(df, chars.str.split('|').str[0].tolist(), scale, args.seed)
+        corpus_path = os.path.join(directory, 'corpus.csv')
+        corpus.to_csv(corpus_path, index=False)
+        bundle = Bundle(os.path.join(directory, 'bundle'))
+
+        corpus, results['build.normalize_corpus'] = measure(lambda: bundle.corpus(corpus_path), args.memory)
+        # e.g. build.similarities.tfidf (the fit), .word_cidf, .tfidf_index, .transformer_embeddings
+        with StepStore(bundle, 'build.similarities', results, args.memory) as store:
+            similarity = Similarities(corpus, store=store, normalized=True)
+        clustering, results['build.clustering'] = measure(
+            lambda: Clustering(corpus, 9, store=bundle, normalized=True), args.memory)
+
+        _, results['build.create_position_matrix'] = measure(
+            lambda: LinkDocumentsAnalyzer.create_position_matrix(corpus['text'], chars, 1), args.memory)
+        analyzer, results['build.link_analysis'] = measure(
+            lambda: LinkDocumentsAnalyzer(corpus['text'], chars, 1, 5), args.memory)
+
+        for method in QUERY_METHODS:
+            registry.query_cache.clear()
+            results[f'query.{method}'] = measure_queries(
+                lambda q: getattr(similarity, method)(q, 20), queries, args.memory)
+
+        registry.query_cache.clear()
+        results['query.predict_cluster'] = measure_queries(clustering.predict_cluster, queries, args.memory)
+        results['query.get_query_ranks'] = measure_queries(analyzer.get_query_ranks, queries, args.memory)
+
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return results
+
+
+def growth(results, scales):
+    # log-log slope between consecutive scales: ~1 is linear, clearly above 1 is super-linear
+    curves = {}
+    for step in results[scales[0]]:
+        points = [(s, results[s][step]['seconds']) for s in scales if step in results[s]]
+        slopes = [math.log(t2 / t1) / math.log(s2 / s1)
+                  for (s1, t1), (s2, t2) in zip(points, points[1:]) if t1 > 0 and t2 > 0]
+        curves[step] = {'seconds': [t for _, t in points], 'slopes': slopes}
+
+    return curves
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Times and profiles retrieve components over synthetic corpora.')
+    parser.add_argument('--scales', default='1,10,100', help='corpus sizes as multiples of the Shahnameh')
+    parser.add_argument('--encoder', choices=['random', 'parsbert'], default='random',
+                        help='random replaces ParsBERT and word2vec with fixed random vectors, so large scales finish')
+    parser.add_argument('--hidden-size', type=int, default=768, help='embedding size of the random encoder')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help='skip tracemalloc peak memory')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='write the results as json to this path')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    os.chdir(os.path.join(BENCHMARKS, '..'))
+
+    df = pd.read_csv(os.path.join(RESOURCES, 'shahnameh-labeled.csv'))
+    chars = pd.read_csv(os.path.join(RESOURCES, 'shahnameh_characters.csv'))['regex']
+    rng = np.random.default_rng(args.seed)
+    queries = [df['text'][i].split('-')[0].strip() for i in rng.choice(len(df), args.queries)]
+
+    if args.encoder == 'random':
+        encoder = HashingEncoder(args.hidden_size, args.seed)
+        registry.get(('encoder', PARSBERT), lambda: encoder)
+        words = sorted({w for text in df['text'] for w in text.replace('-', ' ').split()})
+        registry.get(('word2vec', WORD2VEC), lambda: synthetic_word2vec(words, seed=args.seed))
+
+    scales = [float(s) for s in args.scales.split(',')]
+    results = {}
+    for scale in scales:
+        logger.info(f'Benchmarking {scale:g}x ({int(len(df) * scale)} beyts)...')
+        results[scale] = run_scale(df, chars, scale, queries, args)
+
+    curves = growth(results, scales)
+
+    print(f'{"step":<48}' + ''.join(f'{f"{s:g}x s":>12}' for s in scales) + f'{"slope":>8}{"peak MB":>10}')
+    for step, curve in curves.items():
+        slope = max(curve['slopes'], default=float('nan'))
+        peak = results[scales[-1]][step]['peak_bytes']
+        print(f'{step:<48}' + ''.join(f'{t:>12.3f}' for t in curve['seconds']) + f'{slope:>8.2f}' +
+              (f'{peak / 2 ** 20:>10.1f}' if peak is not None else f'{"-":>10}') + (' !' if slope > 1.2 else ''))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'config': {key: value for key, value in vars(args).items() if key != 'output'},
+                'beyts': {f'{s:g}x': int(len(df) * s) for s in scales},
+                'results': {f'{s:g}x': r for s, r in results.items()},
+                'curves': curves,
+            }, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+import argparse
+import difflib
+import json
+import logging
+import os
+import re
+import time
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+RESOURCES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'resources')
+
+
+class Corpus:
+    # just enough of the ferdosi and words indices for the retrieve service to get realistic responses
+
+    def __init__(self, path):
+        df = pd.read_csv(path)
+        self.beyts = []
+        self.postings = defaultdict(list)
+        words = Counter()
+
+        for i, (text, label) in enumerate(zip(df['text'], df['labels'])):
+            mesras = [m.strip() for m in text.split('-', 1)] + ['']
+            self.beyts.append(
+                {'mesra1': mesras[0], 'mesra2': mesras[1], 'beyt': ' '.join(mesras[:2]), 'label': label})
+
+            tokens = text.replace('-', ' ').split()
+            words.update(tokens)
+            for token in set(tokens):
+                self.postings[token].append(i)
+
+        self.words = words
+        self.by_prefix = defaultdict(list)
+        for word in words:
+            self.by_prefix[word[0]].append(word)
+
+    def search_beyts(self, text, size):
+        scores = Counter()
+        for token in text.split():
+            for i in self.postings.get(token, []):
+                scores[i] += 1
+
+        return [(i, float(score), self.beyts[i]) for i, score in scores.most_common(size)]
+
+    def search_words(self, text, size):
+        word = text.split()[0] if text.split() else ''
+        if word in self.words:
+            return [(word, float(self.words[word]), {'word': word})]
+
+        candidates = difflib.get_close_matches(word, self.by_prefix.get(word[:1], []), n=size, cutoff=0.6)
+        return [(c, float(self.words[c]), {'word': c}) for c in candidates]
+
+
+def match_text(body):
+    # every query the service sends is a single fuzzy match
+    for clause in body.get('query', {}).get('match', {}).values():
+        return clause['query'] if isinstance(clause, dict) else clause
+    return ''
+
+
+def to_hits(index, results):
+    return {
+        'took': 1,
+        'timed_out': False,
+        'hits': {
+            'total': {'value': len(results), 'relation': 'eq'},
+            'max_score': max((score for _, score, _ in results), default=None),
+            'hits': [{'_index': index, '_id': str(i), '_score': score, '_source': source}
+                     for i, score, source in results],
+        },
+    }
+
+
+def make_handler(corpus, latency):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, payload, status=200):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            # the 8.x client refuses to talk to a server without this header
+            self.send_header('X-Elastic-Product', 'Elasticsearch')
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if self.command != 'HEAD':
+                self.wfile.write(body)
+
+        def read_body(self):
+            length = int(self.headers.get('Content-Length', 0))
+            return self.rfile.read(length) if length else b''
+
+        def search(self, index, body, size=None):
+            size = size or body.get('size') or 10
+            text = match_text(body)
+            if index == 'words':
+                return to_hits(index, corpus.search_words(text, size))
+            return to_hits(index, corpus.search_beyts(text, size))
+
+        def msearch(self, index, body):
+            # ndjson of header and body pairs, a header may override the index of the request path
+            lines = [json.loads(line) for line in body.decode('utf-8').splitlines() if line.strip()]
+            responses = []
+            for header, search in zip(lines[::2], lines[1::2]):
+                response = self.search(header.get('index', index), search)
+                responses.append(dict(response, status=200))
+
+            return {'took': 1, 'responses': responses}
+
+        def do_HEAD(self):
+            self.send_json({})
+
+        def do_GET(self):
+            if self.path.split('?')[0] in ('', '/'):
+                return self.send_json({
+                    'name': 'es-stub', 'cluster_name': 'benchmark', 'tagline': 'You Know, for Search',
+                    'version': {'number': '8.3.2', 'build_flavor': 'default'},
+                })
+
+            self.send_json({'error': f'unsupported path {self.path}', 'status': 404}, status=404)
+
+        def do_POST(self):
+            time.sleep(latency)
+            path = self.path.split('?')[0]
+            body = self.read_body()
+
+            matched = re.fullmatch(r'/([^/]+)/_search', path)
+            if matched:
+                return self.send_json(self.search(matched.group(1), json.loads(body or b'{}')))
+
+            matched = re.fullmatch(r'(?:/([^/]+))?/_msearch', path)
+            if matched:
+                return self.send_json(self.msearch(matched.group(1), body))
+
+            self.send_json({'error': f'unsupported path {self.path}', 'status': 404}, status=404)
+
+    return Handler
+
+
+def start(port=0, latency=0.0, path=None):
+    corpus = Corpus(path or os.path.join(RESOURCES, 'shahnameh-labeled.csv'))
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(corpus, latency))
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Elasticsearch stand-in serving the ferdosi and words indices.')
+    parser.add_argument('--port', type=int, default=9200)
+    parser.add_argument('--latency-ms', type=float, default=1.0, help='added to every search to mimic a network hop')
+    parser.add_argument('--corpus', default=None, help='labeled csv, defaults to resources/shahnameh-labeled.csv')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    stub = start(args.port, args.latency_ms / 1e3, args.corpus)
+    logger.info(f'Serving on http://127.0.0.1:{stub.server_address[1]}')
+    stub.serve_forever()
@@ -0,0 +1,258 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent import futures
+
+import grpc
+import numpy as np
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(BENCHMARKS, '..', 'src')
+sys.path.insert(0, SRC)
+
+from api import search_pb2, search_pb2_grpc, query_expansion_pb2, query_expansion_pb2_grpc  # noqa: E402
+from grpc_health.v1 import health_pb2, health_pb2_grpc  # noqa: E402
+
+import es_stub  # noqa: E402
+from queries import load_queries  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+class Client:
+
+    def __init__(self, target, methods=(), sections=(), timeout=30.0):
+        self.channel = grpc.insecure_channel(target)
+        self.search = search_pb2_grpc.SearchStub(self.channel)
+        self.expansion = query_expansion_pb2_grpc.QueryExpandStub(self.channel)
+        self.health = health_pb2_grpc.HealthStub(self.channel)
+        self.methods, self.sections, self.timeout = list(methods), list(sections), timeout
+
+    def request(self, query):
+        return search_pb2.SearchRequest(query=query, methods=self.methods, sections=self.sections)
+
+    def retrieve(self, query):
+        self.search.Retrieve(self.request(query), timeout=self.timeout)
+
+    def retrieve_stream(self, query):
+        # returns when the first section arrived, the caller times the rest
+        first = None
+        for _ in self.search.RetrieveStream(self.request(query), timeout=self.timeout):
+            first = first or time.perf_counter()
+        return first
+
+    def expand(self, query):
+        self.expansion.Expand(query_expansion_pb2.ExpandRequest(query=query), timeout=self.timeout)
+
+    def wait_until_serving(self, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                status = self.health.Check(health_pb2.HealthCheckRequest(service=''), timeout=5).status
+                if status == health_pb2.HealthCheckResponse.SERVING:
+                    return
+            except grpc.RpcError:
+                pass
+            time.sleep(1)
+
+        raise TimeoutError(f'Server was not serving after {timeout}s.')
+
+
+class Recorder:
+
+    def __init__(self):
+        self.latencies = []
+        self.first_messages = []
+        self.errors = Counter()
+        self.lock = threading.Lock()
+
+    def record(self, start, end, first=None, error=None):
+        with self.lock:
+            if error is not None:
+                self.errors[error] += 1
+                return
+
+            self.latencies.append(end - start)
+            if first is not None:
+                self.first_messages.append(first - start)
+
+
+def timed_call(call, query, recorder, scheduled=None):
+    # open-loop requests are timed from when they were due, so a backed-up client cannot hide server stalls
+    start = scheduled if scheduled is not None else time.perf_counter()
+    try:
+        first = call(query)
+        recorder.record(start, time.perf_counter(), first)
+    except grpc.RpcError as e:
+        recorder.record(start, time.perf_counter(), error=e.code().name)
+
+
+def run_closed(call, queries, concurrency, duration, recorder):
+    deadline = time.perf_counter() + duration
+    lock = threading.Lock()
+
+    def worker():
+        while time.perf_counter() < deadline:
+            with lock:
+                _, query = next(queries)
+            timed_call(call, query, recorder)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_open(call, queries, rate, duration, recorder, max_in_flight):
+    interval = 1 / rate
+    start = time.perf_counter()
+    with futures.ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        for i in itertools.count():
+            scheduled = start + i * interval
+            if scheduled - start >= duration:
+                break
+
+            time.sleep(max(scheduled - time.perf_counter(), 0))
+            _, query = next(queries)
+            executor.submit(timed_call, call, query, recorder, scheduled)
+
+
+def percentiles(values):
+    if not values:
+        return None
+
+    values = np.array(values) * 1e3
+    return {
+        'p50': float(np.percentile(values, 50)),
+        'p95': float(np.percentile(values, 95)),
+        'p99': float(np.percentile(values, 99)),
+        'mean': float(values.mean()),
+        'max': float(values.max()),
+    }
+
+
+def summarize(recorder, elapsed):
+    errors = sum(recorder.errors.values())
+    summary = {
+        'requests': len(recorder.latencies) + errors,
+        'errors': errors,
+        'errors_by_code': dict(recorder.errors),
+        'throughput_rps': len(recorder.latencies) / elapsed,
+        'latency_ms': percentiles(recorder.latencies),
+    }
+    if recorder.first_messages:
+        summary['first_message_ms'] = percentiles(recorder.first_messages)
+
+    return summary
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(args):
+    # the whole stack runs locally: the stub stands in for Elasticsearch and the server is started against it
+    stub = es_stub.start(latency=args.es_latency_ms / 1e3)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+
+    port = free_port()
+    env = dict(os.environ, GRPC_PORT=str(port), METRICS_PORT='0',
+               ELASTICSEARCH_URL=f'http://127.0.0.1:{stub.server_address[1]}')
+    # main.py resolves resources/ against the working directory, and resources/ lives in retrieve/
+    server = subprocess.Popen([sys.executable, os.path.join(SRC, 'main.py')], cwd=os.path.join(BENCHMARKS, '..'),
+                              env=env)
+    return stub, server, f'127.0.0.1:{port}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replays Shahnameh queries against the Retrieve and Expand RPCs.')
+    parser.add_argument('--target', default='127.0.0.1:50051', help='server address, ignored with --serve')
+    parser.add_argument('--serve', action='store_true', help='start the server and an Elasticsearch stand-in locally')
+    parser.add_argument('--rpcs', default='retrieve,retrieve_stream,expand')
+    parser.add_argument('--concurrency', type=int, default=4, help='closed loop with this many clients')
+    parser.add_argument('--rate', type=float, default=0, help='open loop at this many requests/sec instead')
+    parser.add_argument('--max-in-flight', type=int, default=256, help='client threads of the open loop')
+    parser.add_argument('--duration', type=float, default=30, help='seconds per RPC')
+    parser.add_argument('--warmup', type=float, default=5, help='seconds per RPC that are not recorded')
+    parser.add_argument('--queries', type=int, default=2_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--methods', default='', help='comma separated SearchRequest.methods')
+    parser.add_argument('--sections', default='', help='comma separated SearchRequest.sections')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--es-latency-ms', type=float, default=1.0)
+    parser.add_argument('--ready-timeout', type=float, default=1_800)
+    parser.add_argument('--output', default=None, help='write the results as json to this path')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    resources = os.path.join(BENCHMARKS, '..', 'resources')
+    queries = load_queries(os.path.join(resources, 'shahnameh-labeled.csv'),
+                           os.path.join(resources, 'shahnameh_characters.csv'), args.queries, args.seed)
+
+    stub = server = None
+    target = args.target
+    if args.serve:
+        stub, server, target = start_server(args)
+
+    client = Client(target, filter(None, args.methods.split(',')), filter(None, args.sections.split(',')),
+                    args.timeout)
+    results = {}
+    try:
+        client.wait_until_serving(args.ready_timeout)
+
+        for rpc in args.rpcs.split(','):
+            call = getattr(client, rpc)
+            cycle = itertools.cycle(queries)
+            for phase, duration in [('warmup', args.warmup), ('measure', args.duration)]:
+                if duration <= 0:
+                    continue
+
+                recorder = Recorder()
+                start = time.perf_counter()
+                if args.rate:
+                    run_open(call, cycle, args.rate, duration, recorder, args.max_in_flight)
+                else:
+                    run_closed(call, cycle, args.concurrency, duration, recorder)
+
+                if phase == 'measure':
+                    results[rpc] = summarize(recorder, time.perf_counter() - start)
+                    logger.info(f'{rpc}: {json.dumps(results[rpc])}')
+
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if stub is not None:
+            stub.shutdown()
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        'query_mix': dict(Counter(kind for kind, _ in queries)),
+        'results': results,
+    }
+
+    print(f'{"rpc":<16}{"requests":>10}{"errors":>8}{"rps":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}')
+    for rpc, r in results.items():
+        latency = r['latency_ms'] or defaultdict(float)
+        print(f'{rpc:<16}{r["requests"]:>10}{r["errors"]:>8}{r["throughput_rps"]:>10.1f}'
+              f'{latency["p50"]:>10.1f}{latency["p95"]:>10.1f}{latency["p99"]:>10.1f}')
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+import random
+
+import pandas as pd
+
+from services.calibration import misspell
+
+
+def load_queries(labeled, characters, n=1_000, seed=0, mix=(0.5, 0.2, 0.3)):
+    # mix is the share of beyts/mesras, hero names and misspelled variants of either
+    rng = random.Random(seed)
+    texts = pd.read_csv(labeled)['text'].tolist()
+    names = [name.split('(')[0].strip() for name in pd.read_csv(characters)['name']]
+
+    queries = []
+    for _ in range(n):
+        kind = rng.choices(['beyt', 'name', 'misspelled'], weights=mix)[0]
+        if kind == 'name':
+            queries.append(('name', rng.choice(names)))
+            continue
+
+        text = rng.choice(texts)
+        text = text if rng.random() < 0.5 else text.split('-')[0].strip()
+        if kind == 'beyt':
+            queries.append(('beyt', text))
+        else:
+            queries.append(('misspelled', misspell(text if rng.random() < 0.7 else rng.choice(names), rng)))
+
+    return queries
@@ -19,6 +19,11 @@ class SearchStub(object):
                 request_serializer=api_dot_search__pb2.SearchRequest.SerializeToString,
                 response_deserializer=api_dot_search__pb2.SearchResponse.FromString,
                 )
+        self.RetrieveStream = channel.unary_stream(
+                '/api.Search/RetrieveStream',
+                request_serializer=api_dot_search__pb2.SearchRequest.SerializeToString,
+                response_deserializer=api_dot_search__pb2.SearchSection.FromString,
+                )
 
 
 class SearchServicer(object):
@@ -30,6 +35,12 @@ class SearchServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def RetrieveStream(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_SearchServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -38,6 +49,11 @@ def add_SearchServicer_to_server(servicer, server):
                     request_deserializer=api_dot_search__pb2.SearchRequest.FromString,
                     response_serializer=api_dot_search__pb2.SearchResponse.SerializeToString,
             ),
+            'RetrieveStream': grpc.unary_stream_rpc_method_handler(
+                    servicer.RetrieveStream,
+                    request_deserializer=api_dot_search__pb2.SearchRequest.FromString,
+                    response_serializer=api_dot_search__pb2.SearchSection.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'api.Search', rpc_method_handlers)
@@ -64,3 +80,20 @@ class Search(object):
             api_dot_search__pb2.SearchResponse.FromString,
             options, channel_credentials,
             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def RetrieveStream(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(request, target, '/api.Search/RetrieveStream',
+            api_dot_search__pb2.SearchRequest.SerializeToString,
+            api_dot_search__pb2.SearchSection.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
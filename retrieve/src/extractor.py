@@ -1,4 +1,6 @@
+import hashlib
 import io
+import json
 import os.path
 import logging
 
@@ -6,6 +8,9 @@ import pandas as pd
 from tqdm import tqdm
 from bs4 import BeautifulSoup
 
+# bump whenever the extraction logic changes, so cached csv files are rebuilt
+EXTRACTOR_VERSION = 1
+
 
 class HTML2CSV:
 
@@ -21,12 +26,42 @@ class HTML2CSV:
     def filter_poems_labels(tag):
         return HTML2CSV.filter_poems(tag) or HTML2CSV.filter_labels(tag)
 
+    @staticmethod
+    def source_stamp(path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(2 ** 20), b''):
+                digest.update(chunk)
+
+        return {'sha256': digest.hexdigest(), 'extractor_version': EXTRACTOR_VERSION}
+
+    @staticmethod
+    def is_cached(target, stamp_path, stamp):
+        if not os.path.exists(target) or not os.path.exists(stamp_path):
+            return False
+
+        # a truncated or unreadable stamp only means extracting again
+        try:
+            with open(stamp_path, 'r') as file:
+                return json.load(file) == stamp
+        except (ValueError, OSError):
+            return False
+
     @staticmethod
     def extract_to(directory, file_name):
 
+        source = os.path.join(directory, 'shahnameh-ferdosi.htm')
+        target = os.path.join(directory, file_name)
+        stamp_path = f'{target}.stamp'
+
+        stamp = HTML2CSV.source_stamp(source)
+        if HTML2CSV.is_cached(target, stamp_path, stamp):
+            logging.info(f'{file_name} is up to date with {os.path.basename(source)}, skipping extraction.')
+            return
+
         logging.info('Extracting...')
 
-        with io.open(os.path.join(directory, 'shahnameh-ferdosi.htm'), 'r', encoding='utf-8') as file:
+        with io.open(source, 'r', encoding='utf-8') as file:
             html = file.read()
 
         soup = BeautifulSoup(html, 'html.parser')
@@ -57,5 +92,12 @@ class HTML2CSV:
             mesras = [sp.strip() for sp in text.split('****')]
             dataset.append({'text': ' - '.join(mesras), 'labels': label})
 
-        pd.DataFrame(dataset).to_csv(os.path.join(directory, file_name), index=False)
+        # the stamp is written last, so an interrupted extraction is redone on the next start
+        pd.DataFrame(dataset).to_csv(f'{target}.tmp', index=False)
+        os.replace(f'{target}.tmp', target)
+
+        with open(f'{stamp_path}.tmp', 'w') as file:
+            json.dump(stamp, file)
+        os.replace(f'{stamp_path}.tmp', stamp_path)
+
         logging.info('Extracted.')
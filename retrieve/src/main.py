@@ -1,29 +1,177 @@
 from concurrent import futures
+import asyncio
 import logging
+import multiprocessing
 import os
+import signal
+import sys
+import time
 
 import grpc
+from grpc_health.v1 import health, health_pb2_grpc
 from api import search_pb2, search_pb2_grpc, query_expansion_pb2, query_expansion_pb2_grpc
 from extractor import HTML2CSV
-from server import search_server, query_exapnsion_server
+from server import search_server, query_exapnsion_server, readiness, monitoring
+from services import metrics
 
+STARTED = time.monotonic()
 
-def serve(_port, _grpc_workers):
+
+def seal(bundle):
+    if not bundle.version:
+        bundle.seal()
+
+
+def load(searcher, expander):
+    # a bundle built on the fly is sealed here too, the response cache only runs on a sealed bundle's version
+    searcher.__init__()
+    expander.__init__(searcher.bundle)
+    seal(searcher.bundle)
+    searcher.open_response_cache()
+
+
+def serve(_port, _grpc_workers, _options=None):
     logging.info('Starting server...')
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=_grpc_workers))
-    search_pb2_grpc.add_SearchServicer_to_server(search_server.SearchServer(), server)
-    query_expansion_pb2_grpc.add_QueryExpandServicer_to_server(query_exapnsion_server.QueryExpansionServer(), server)
+    readiness_gate = readiness.ReadinessInterceptor()
+    health_servicer = health.HealthServicer()
+    readiness.set_status(health_servicer, False)
+
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=_grpc_workers), options=_options,
+        interceptors=[readiness_gate, monitoring.MetricsInterceptor()])
+    health_pb2_grpc.add_HealthServicer_to_server(health_servicer, server)
+
+    # registered before it is loaded, so health checks are answered while the models load
+    searcher = search_server.SearchServer.__new__(search_server.SearchServer)
+    expander = query_exapnsion_server.QueryExpansionServer.__new__(query_exapnsion_server.QueryExpansionServer)
+    search_pb2_grpc.add_SearchServicer_to_server(searcher, server)
+    query_expansion_pb2_grpc.add_QueryExpandServicer_to_server(expander, server)
     server.add_insecure_port(f'[::]:{_port}')
     server.start()
-    server.wait_for_termination()
-    logging.info('Server started.')
+
+    def drain(_signum, _frame):
+        logging.info('Draining in-flight requests...')
+        health_servicer.enter_graceful_shutdown()
+        server.stop(float(os.getenv('GRPC_DRAIN_SECONDS', 30)))
+
+    signal.signal(signal.SIGTERM, drain)
+
+    load(searcher, expander)
+    searcher.warmup(int(os.getenv('WARMUP_QUERIES', 8)))
+    readiness_gate.ready.set()
+    readiness.set_status(health_servicer, True)
+
+    logging.info(f'Server started in {time.monotonic() - STARTED:.1f}s.')
     logging.info(f'Listening on port {_port} with {_grpc_workers} workers.')
+    server.wait_for_termination()
+
+
+async def serve_aio(_port, _max_concurrent_rpcs):
+    # requests are multiplexed on the event loop; CPU-bound stages run on RETRIEVE_STAGE_WORKERS threads
+    logging.info('Starting asyncio server...')
+    readiness_gate = readiness.AsyncReadinessInterceptor()
+    health_servicer = health.aio.HealthServicer()
+    await readiness.set_status_async(health_servicer, False)
+
+    server = grpc.aio.server(maximum_concurrent_rpcs=_max_concurrent_rpcs or None,
+                             interceptors=[readiness_gate, monitoring.AsyncMetricsInterceptor()])
+    health_pb2_grpc.add_HealthServicer_to_server(health_servicer, server)
+
+    searcher = search_server.SearchServer.__new__(search_server.SearchServer)
+    expander_class = query_exapnsion_server.AsyncQueryExpansionServer
+    expander = expander_class.__new__(expander_class)
+    search_pb2_grpc.add_SearchServicer_to_server(search_server.AsyncSearchServer(searcher), server)
+    query_expansion_pb2_grpc.add_QueryExpandServicer_to_server(expander, server)
+    server.add_insecure_port(f'[::]:{_port}')
+    await server.start()
+
+    async def drain():
+        logging.info('Draining in-flight requests...')
+        await health_servicer.enter_graceful_shutdown()
+        await server.stop(float(os.getenv('GRPC_DRAIN_SECONDS', 30)))
+
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, lambda: asyncio.ensure_future(drain()))
+
+    # loading and warmup run off the loop, which keeps answering health checks meanwhile
+    await loop.run_in_executor(None, load, searcher, expander)
+    await loop.run_in_executor(None, searcher.warmup, int(os.getenv('WARMUP_QUERIES', 8)))
+    readiness_gate.ready.set()
+    await readiness.set_status_async(health_servicer, True)
+
+    logging.info(f'Server started in {time.monotonic() - STARTED:.1f}s.')
+    logging.info(f'Listening on port {_port} with at most {_max_concurrent_rpcs or "unlimited"} concurrent RPCs.')
+    await server.wait_for_termination()
+
+
+def build():
+    # writes every on-disk artifact once and seals the bundle, so servers and workers only map them
+    logging.basicConfig(level=logging.DEBUG)
+    start = time.monotonic()
+    bundle = search_server.SearchServer().bundle
+    query_exapnsion_server.QueryExpansionServer(bundle)
+    seal(bundle)
+
+    logging.info(f'Bundle {bundle.version} is ready in {bundle.directory} after {time.monotonic() - start:.1f}s.')
+
+
+def serve_worker(_port, _grpc_workers, _torch_threads, _index):
+    logging.basicConfig(level=logging.DEBUG, format=f'[worker {os.getpid()}] %(levelname)s:%(name)s:%(message)s')
+    os.environ.setdefault('ENCODER_THREADS', str(_torch_threads))
+
+    # each worker exposes its own metrics on consecutive ports
+    metrics_port = int(os.getenv('METRICS_PORT', 9102))
+    metrics.serve_metrics(metrics_port + _index if metrics_port else 0)
+    serve(_port, _grpc_workers, [('grpc.so_reuseport', 1)])
+
+
+def serve_prefork(_port, _grpc_workers, _processes):
+    # workers are spawned, not forked, so none of them inherits grpc or torch threads from the parent
+    context = multiprocessing.get_context('spawn')
+
+    builder = context.Process(target=build)
+    builder.start()
+    builder.join()
+    if builder.exitcode != 0:
+        raise SystemExit(f'Building artifacts failed with exit code {builder.exitcode}.')
+
+    torch_threads = max(1, os.cpu_count() // _processes)
+    workers = [context.Process(target=serve_worker, args=(_port, _grpc_workers, torch_threads, i))
+               for i in range(_processes)]
+    for worker in workers:
+        worker.start()
+
+    def stop(signum, _frame):
+        for w in workers:
+            if w.is_alive():
+                os.kill(w.pid, signum)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    logging.info(f'Started {_processes} workers on port {_port}.')
+    for worker in workers:
+        worker.join()
 
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
     HTML2CSV.extract_to('resources/', 'shahnameh-labeled.csv')
+    if sys.argv[1:] == ['build']:
+        build()
+        sys.exit(0)
+
     port = os.getenv('GRPC_PORT', '50051')
-    grpc_workers = int(os.getenv('MAX_GRPC_WORKERS', 2))
-    serve(port, grpc_workers)
 
+    mode = os.getenv('GRPC_SERVER_MODE', 'thread')
+
+    if mode != 'prefork':
+        metrics.serve_metrics()
+
+    if mode == 'aio':
+        asyncio.run(serve_aio(port, int(os.getenv('GRPC_MAX_CONCURRENT_RPCS', 0))))
+    elif mode == 'prefork':
+        serve_prefork(port, int(os.getenv('MAX_GRPC_WORKERS', 2)), int(os.getenv('GRPC_PROCESSES', os.cpu_count())))
+    else:
+        grpc_workers = int(os.getenv('MAX_GRPC_WORKERS', 2))
+        serve(port, grpc_workers)
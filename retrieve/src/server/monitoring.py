@@ -0,0 +1,106 @@
+import time
+
+import grpc
+
+from services import metrics
+
+
+def observe(method, start, failed):
+    metrics.RPC_SECONDS.labels(method).observe(time.perf_counter() - start)
+    if failed:
+        metrics.RPC_ERRORS.labels(method).inc()
+
+
+def method_name(handler_call_details):
+    return handler_call_details.method.rsplit('/', 1)[-1]
+
+
+def timed(method, behavior):
+    def unary(request, context):
+        start, failed = time.perf_counter(), True
+        with metrics.RPC_IN_FLIGHT.labels(method).track_inprogress():
+            try:
+                response = behavior(request, context)
+                failed = False
+                return response
+            finally:
+                observe(method, start, failed)
+
+    return unary
+
+
+def timed_stream(method, behavior):
+    # a streaming RPC lasts until its last message is sent, not until the handler returns the iterator
+    def stream(request, context):
+        start, failed = time.perf_counter(), True
+        with metrics.RPC_IN_FLIGHT.labels(method).track_inprogress():
+            try:
+                yield from behavior(request, context)
+                failed = False
+            finally:
+                observe(method, start, failed)
+
+    return stream
+
+
+def timed_async(method, behavior):
+    async def unary(request, context):
+        start, failed = time.perf_counter(), True
+        with metrics.RPC_IN_FLIGHT.labels(method).track_inprogress():
+            try:
+                response = await behavior(request, context)
+                failed = False
+                return response
+            finally:
+                observe(method, start, failed)
+
+    return unary
+
+
+def timed_async_stream(method, behavior):
+    async def stream(request, context):
+        start, failed = time.perf_counter(), True
+        with metrics.RPC_IN_FLIGHT.labels(method).track_inprogress():
+            try:
+                async for response in behavior(request, context):
+                    yield response
+                failed = False
+            finally:
+                observe(method, start, failed)
+
+    return stream
+
+
+def instrumented(handler, method, unary, stream):
+    if handler.unary_stream:
+        return grpc.unary_stream_rpc_method_handler(
+            stream(method, handler.unary_stream), request_deserializer=handler.request_deserializer,
+            response_serializer=handler.response_serializer)
+
+    return grpc.unary_unary_rpc_method_handler(
+        unary(method, handler.unary_unary), request_deserializer=handler.request_deserializer,
+        response_serializer=handler.response_serializer)
+
+
+def is_instrumented(handler, handler_call_details):
+    return handler is not None and handler_call_details.method.startswith('/api.')
+
+
+class MetricsInterceptor(grpc.ServerInterceptor):
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if not is_instrumented(handler, handler_call_details):
+            return handler
+
+        return instrumented(handler, method_name(handler_call_details), timed, timed_stream)
+
+
+class AsyncMetricsInterceptor(grpc.aio.ServerInterceptor):
+
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        if not is_instrumented(handler, handler_call_details):
+            return handler
+
+        return instrumented(handler, method_name(handler_call_details), timed_async, timed_async_stream)
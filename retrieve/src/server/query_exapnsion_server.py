@@ -1,26 +1,78 @@
 import os
 from api import query_expansion_pb2, query_expansion_pb2_grpc
 from services import elastic
+from services.bundle import Bundle
+from services.calibration import ExpansionCalibration
+from services.spelling import SpellingIndex, confidences
 
 
 class QueryExpansionServer(query_expansion_pb2_grpc.QueryExpandServicer):
-    def __init__(self):
-        es_host = os.getenv('ELASTICSEARCH_URL', 'http://localhost:9200')
-        self.es_query = elastic.ElasticSearchQuery(es_host=es_host)
+    elastic_query = elastic.ElasticSearchQuery
 
-    def Expand(self, request, context) -> query_expansion_pb2.ExpandResponse:
-        query = request.query
-        words = []
-        for w in query.split():
-            correct_word = self.es_query.find_word(w)
-            if correct_word:
-                words.append(correct_word)
+    def __init__(self, bundle=None):
+        self.max_rewrites = int(os.getenv('EXPANSION_REWRITES', 3))
+        self.beam = int(os.getenv('EXPANSION_BEAM', 8))
+        self.candidates = int(os.getenv('EXPANSION_CANDIDATES', 5))
+        self.smoothing = float(os.getenv('EXPANSION_SMOOTHING', 50.0))
+
+        # words are corrected in process against the corpus vocabulary, unless EXPANSION_BACKEND=elastic
+        self.backend = os.getenv('EXPANSION_BACKEND', 'spelling')
+        if self.backend == 'elastic':
+            es_host = os.getenv('ELASTICSEARCH_URL', 'http://localhost:9200')
+            self.es_query = self.elastic_query(es_host=es_host)
+            return
+
+        bundle = bundle or Bundle()
+        df = bundle.corpus('resources/shahnameh-labeled.csv')
+        self.spelling = SpellingIndex.load_or_build(bundle, df['text'])
+
+        # the edit weight and confidences are fitted on held-out misspellings when the bundle is built,
+        # the environment variables only override them
+        calibration = ExpansionCalibration.load_or_fit(
+            bundle, df['text'].tolist(), self.beam, self.candidates, self.smoothing, self.max_rewrites)
+        self.edit_weight = float(os.getenv('EXPANSION_EDIT_WEIGHT', calibration.edit_weight))
+        self.temperature = float(os.getenv('EXPANSION_TEMPERATURE', calibration.temperature))
+        self.outside = float(os.getenv('EXPANSION_OUTSIDE', calibration.outside))
 
+    @staticmethod
+    def to_expand_response(rewrites) -> query_expansion_pb2.ExpandResponse:
         return query_expansion_pb2.ExpandResponse(
             items=[
                 query_expansion_pb2.ExpandResponseItem(
-                    expanded=' '.join(words),
-                    confidence=1.0,
-                )
+                    expanded=expanded,
+                    confidence=confidence,
+                ) for expanded, confidence in rewrites
             ]
         )
+
+    @staticmethod
+    def from_words(words):
+        # elasticsearch only returns its best match for each word, so there is a single rewrite
+        return [(' '.join(word for word in words if word), 1.0)]
+
+    def rewrite(self, query):
+        if not query.split():
+            return self.from_words([])
+
+        # confidences are spread over the whole beam, so the returned ones add up to less than 1
+        rewrites = self.spelling.rewrites(query, self.beam, self.candidates, self.edit_weight, self.smoothing)
+        if not rewrites:
+            # no word is within reach of the vocabulary, so the query is returned as it is with nothing to back it
+            return [(query, 0.0)]
+
+        weights = confidences([score for _, score in rewrites], self.temperature, self.outside)
+        return [(expanded, float(weight)) for (expanded, _), weight in zip(rewrites, weights)][:self.max_rewrites]
+
+    def Expand(self, request, context) -> query_expansion_pb2.ExpandResponse:
+        if self.backend == 'elastic':
+            return self.to_expand_response(self.from_words(self.es_query.find_words(request.query.split())))
+        return self.to_expand_response(self.rewrite(request.query))
+
+
+class AsyncQueryExpansionServer(QueryExpansionServer):
+    elastic_query = elastic.AsyncElasticSearchQuery
+
+    async def Expand(self, request, context) -> query_expansion_pb2.ExpandResponse:
+        if self.backend == 'elastic':
+            return self.to_expand_response(self.from_words(await self.es_query.find_words(request.query.split())))
+        return self.to_expand_response(self.rewrite(request.query))
@@ -0,0 +1,66 @@
+import threading
+
+import grpc
+from grpc_health.v1 import health_pb2
+
+# '' is the overall status of the server
+SERVICES = ['', 'api.Search', 'api.QueryExpand']
+
+
+def set_status(health_servicer, serving):
+    status = health_pb2.HealthCheckResponse.SERVING if serving else health_pb2.HealthCheckResponse.NOT_SERVING
+    for service in SERVICES:
+        health_servicer.set(service, status)
+
+
+async def set_status_async(health_servicer, serving):
+    status = health_pb2.HealthCheckResponse.SERVING if serving else health_pb2.HealthCheckResponse.NOT_SERVING
+    for service in SERVICES:
+        await health_servicer.set(service, status)
+
+
+def unavailable(request, context):
+    context.abort(grpc.StatusCode.UNAVAILABLE, 'Server is still loading.')
+
+
+async def unavailable_async(request, context):
+    await context.abort(grpc.StatusCode.UNAVAILABLE, 'Server is still loading.')
+
+
+def rejecting(handler, behavior):
+    if handler.unary_stream:
+        return grpc.unary_stream_rpc_method_handler(
+            behavior, request_deserializer=handler.request_deserializer,
+            response_serializer=handler.response_serializer)
+
+    return grpc.unary_unary_rpc_method_handler(
+        behavior, request_deserializer=handler.request_deserializer, response_serializer=handler.response_serializer)
+
+
+def is_gated(handler, handler_call_details):
+    return handler is not None and not handler_call_details.method.startswith('/grpc.health.')
+
+
+class ReadinessInterceptor(grpc.ServerInterceptor):
+    # the port is open while the servicers load, so everything but health checks is turned away until then
+    def __init__(self):
+        self.ready = threading.Event()
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if self.ready.is_set() or not is_gated(handler, handler_call_details):
+            return handler
+
+        return rejecting(handler, unavailable)
+
+
+class AsyncReadinessInterceptor(grpc.aio.ServerInterceptor):
+    def __init__(self):
+        self.ready = threading.Event()
+
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        if self.ready.is_set() or not is_gated(handler, handler_call_details):
+            return handler
+
+        return rejecting(handler, unavailable_async)
@@ -1,7 +1,7 @@
 import os
 from abc import ABC, abstractmethod
 from api import search_pb2
-from services import elastic
+from services import elastic, tracing
 
 
 class SearchResult:
@@ -12,96 +12,61 @@ class SearchResult:
         self.max_results = max_results
 
     @abstractmethod
-    def get_search_result(self, query) -> search_pb2.DocumentResponse:
+    def get_search_result(self, query, max_results=None) -> search_pb2.DocumentResponse:
         pass
 
     @property
     def method(self):
         return self._method
 
+    def build_response(self, results) -> search_pb2.DocumentResponse:
+        with tracing.span('protobuf'):
+            return search_pb2.DocumentResponse(
+                items=[
+                    search_pb2.DocumentResponseItem(
+                        document=search_pb2.Document(
+                            id=f'{i}',
+                            mesra1=poem.split('-')[0].strip(),
+                            mesra2=poem.split('-')[1].strip(),
+                            label=label,
+                        ),
+                        reason_of_choice=self._method,
+                        similarity=similarity,
+                    ) for i, (poem, label, similarity) in enumerate(results)
+                ]
+            )
+
 
 class BooleanSearchResult(SearchResult):
     _method = 'boolean'
 
-    def get_search_result(self, query) -> search_pb2.DocumentResponse:
-        return search_pb2.DocumentResponse(
-            items=[
-                search_pb2.DocumentResponseItem(
-                    document=search_pb2.Document(
-                        id=f'{i}',
-                        mesra1=poem.split('-')[0].strip(),
-                        mesra2=poem.split('-')[1].strip(),
-                        label=label,
-                    ),
-                    reason_of_choice=self._method,
-                    similarity=similarity,
-                ) for i, (poem, label, similarity) in
-                enumerate(self.similarity.get_similar_by_boolean(query, self.max_results))
-            ]
-        )
+    def get_search_result(self, query, max_results=None) -> search_pb2.DocumentResponse:
+        results = self.similarity.get_similar_by_boolean(query, max_results or self.max_results)
+        return self.build_response(results)
 
 
 class TfidfSearchResult(SearchResult):
     _method = 'tfidf'
 
-    def get_search_result(self, query) -> search_pb2.DocumentResponse:
-        return search_pb2.DocumentResponse(
-            items=[
-                search_pb2.DocumentResponseItem(
-                    document=search_pb2.Document(
-                        id=f'{i}',
-                        mesra1=poem.split('-')[0].strip(),
-                        mesra2=poem.split('-')[1].strip(),
-                        label=label,
-                    ),
-                    reason_of_choice=self._method,
-                    similarity=similarity,
-                ) for i, (poem, label, similarity) in
-                enumerate(self.similarity.get_similar_by_tfidf(query, self.max_results))
-            ]
-        )
+    def get_search_result(self, query, max_results=None) -> search_pb2.DocumentResponse:
+        results = self.similarity.get_similar_by_tfidf(query, max_results or self.max_results)
+        return self.build_response(results)
 
 
 class WordEmbeddingSearchResult(SearchResult):
     _method = 'word_embedding'
 
-    def get_search_result(self, query) -> search_pb2.DocumentResponse:
-        return search_pb2.DocumentResponse(
-            items=[
-                search_pb2.DocumentResponseItem(
-                    document=search_pb2.Document(
-                        id=f'{i}',
-                        mesra1=poem.split('-')[0].strip(),
-                        mesra2=poem.split('-')[1].strip(),
-                        label=label,
-                    ),
-                    reason_of_choice=self._method,
-                    similarity=similarity,
-                ) for i, (poem, label, similarity) in
-                enumerate(self.similarity.get_similar_by_word_embedding(query, self.max_results))
-            ]
-        )
+    def get_search_result(self, query, max_results=None) -> search_pb2.DocumentResponse:
+        results = self.similarity.get_similar_by_word_embedding(query, max_results or self.max_results)
+        return self.build_response(results)
 
 
 class SentEmbeddingSearchResult(SearchResult):
     _method = 'sent_embedding'
 
-    def get_search_result(self, query) -> search_pb2.DocumentResponse:
-        return search_pb2.DocumentResponse(
-            items=[
-                search_pb2.DocumentResponseItem(
-                    document=search_pb2.Document(
-                        id=f'{i}',
-                        mesra1=poem.split('-')[0].strip(),
-                        mesra2=poem.split('-')[1].strip(),
-                        label=label,
-                    ),
-                    reason_of_choice=self._method,
-                    similarity=similarity,
-                ) for i, (poem, label, similarity) in
-                enumerate(self.similarity.get_similar_by_sentence_embedding(query, self.max_results))
-            ]
-        )
+    def get_search_result(self, query, max_results=None) -> search_pb2.DocumentResponse:
+        results = self.similarity.get_similar_by_sentence_embedding(query, max_results or self.max_results)
+        return self.build_response(results)
 
 
 class ElasticSearchResult(SearchResult):
@@ -112,8 +77,13 @@ class ElasticSearchResult(SearchResult):
         es_host = os.getenv('ELASTICSEARCH_URL', 'http://localhost:9200')
         self.es_query = elastic.ElasticSearchQuery(es_host=es_host)
 
-    def get_search_result(self, query) -> search_pb2.DocumentResponse:
-        results = self.es_query.search(query)
+    def get_search_result(self, query, max_results=None) -> search_pb2.DocumentResponse:
+        results = self.es_query.search(query, size=max_results)
+        with tracing.span('protobuf'):
+            return self.to_document_response(results)
+
+    @staticmethod
+    def to_document_response(results) -> search_pb2.DocumentResponse:
         return search_pb2.DocumentResponse(
             items=[
                 search_pb2.DocumentResponseItem(
@@ -126,4 +96,17 @@ class ElasticSearchResult(SearchResult):
                     similarity=r['_score'],
                 ) for r in results['hits']['hits']
             ]
-        )
\ No newline at end of file
+        )
+
+
+class AsyncElasticSearchResult(ElasticSearchResult):
+
+    def __init__(self):
+        SearchResult.__init__(self)
+        es_host = os.getenv('ELASTICSEARCH_URL', 'http://localhost:9200')
+        self.es_query = elastic.AsyncElasticSearchQuery(es_host=es_host)
+
+    async def get_search_result(self, query, max_results=None) -> search_pb2.DocumentResponse:
+        results = await self.es_query.search(query, size=max_results)
+        with tracing.span('protobuf'):
+            return self.to_document_response(results)
@@ -1,18 +1,62 @@
+import asyncio
+import functools
+import grpc
+import logging
+import os
+import random
+import time
+from concurrent import futures
 from typing import List
 import pandas as pd
 from api import search_pb2, search_pb2_grpc
 from server import search_result
-from services.similarities import Similarities
+from services.similarities import WORD2VEC, Similarities
 from services.clustring import Clustering
-from services.classification import get_classifier
+from services.registry import PARSBERT, normalize_query, registry
+from services.response_cache import ResponseCache
+from services.bundle import Bundle
+from services import metrics, tracing
+from services.encoder import sample_queries
 
 from services.link_analysis import LinkDocumentsAnalyzer
 
+logger = logging.getLogger(__name__)
+
+
+CORPUS = 'resources/shahnameh-labeled.csv'
+CHARACTERS = 'resources/shahnameh_characters.csv'
+CITIES = 'resources/shahnameh_cities.csv'
+CLUSTERS = 9
+
+# (threshold, window size) of the character and place graphs
+LINK_ANALYSIS = {'chars': (1, 5), 'places': (1, 20)}
+
+SECTIONS = {
+    'classification': ['classification'],
+    'clustering': ['clustering'],
+    'important_names': ['important_chars', 'important_places'],
+}
+
+
+def parse_timeouts(value):
+    # e.g. "elastic=2,sent_embedding=5"
+    return {name.strip(): float(timeout) for name, timeout in
+            (item.split('=') for item in value.split(',') if item.strip())}
+
 
 class SearchServer(search_pb2_grpc.SearchServicer):
-    def __init__(self):
-        df = pd.read_csv('resources/shahnameh-labeled.csv')
-        similarity = Similarities(df)
+    def __init__(self, bundle=None):
+        # everything derived from the corpus is read from (or, on a cold bundle, written to) one artifact bundle
+        self.bundle = bundle or Bundle()
+        self.bundle.sources([CORPUS, CHARACTERS, CITIES, WORD2VEC],
+                            {'clusters': CLUSTERS, 'link_analysis': LINK_ANALYSIS, 'encoder': PARSBERT})
+        if self.bundle.version:
+            logger.info(f'Loading bundle {self.bundle.version}.')
+        else:
+            logger.warning(f'{self.bundle.directory} is not sealed, missing artifacts are built on the fly.')
+
+        df = self.bundle.corpus(CORPUS)
+        similarity = Similarities(df, store=self.bundle, normalized=True)
         self.search_result_providers: List[search_result.SearchResult] = [
             search_result.TfidfSearchResult(similarity),
             search_result.BooleanSearchResult(similarity),
@@ -21,26 +65,52 @@ class SearchServer(search_pb2_grpc.SearchServicer):
             search_result.ElasticSearchResult(),
         ]
 
-        self.clustering = Clustering(df, 9, _checkpoint='resources/clustering')
+        self.clustering = Clustering(
+            df, CLUSTERS, _checkpoint='resources/clustering', store=self.bundle, normalized=True)
 
-        chars = pd.read_csv('resources/shahnameh_characters.csv')['regex']
-        cities = pd.read_csv('resources/shahnameh_cities.csv')['city']
+        chars = pd.read_csv(CHARACTERS)['regex']
+        cities = pd.read_csv(CITIES)['city']
         doc = df['text']
 
-        self.analyzer_chars = LinkDocumentsAnalyzer(doc, chars, 1, 5)
-        self.analyzer_place = LinkDocumentsAnalyzer(doc, cities, 1, 20)
+        self.analyzer_chars = LinkDocumentsAnalyzer(
+            doc, chars, *LINK_ANALYSIS['chars'], store=self.bundle, name='chars')
+        self.analyzer_place = LinkDocumentsAnalyzer(
+            doc, cities, *LINK_ANALYSIS['places'], store=self.bundle, name='places')
 
-        self.classification = get_classifier('./resources/classification/')
+        self.classification = registry.classifier('./resources/classification/')
 
-    def Retrieve(self, request, context) -> search_pb2.SearchResponse:
-        query = request.query
+        self.executor = futures.ThreadPoolExecutor(max_workers=int(os.getenv('RETRIEVE_STAGE_WORKERS', 8)))
+        self.default_timeout = float(os.getenv('RETRIEVE_STAGE_TIMEOUT', 10))
+        self.timeouts = parse_timeouts(os.getenv('RETRIEVE_STAGE_TIMEOUTS', ''))
+        # elasticsearch refuses to page past index.max_result_window, 10000 by default
+        self.max_results = int(os.getenv('RETRIEVE_MAX_RESULTS', 10_000))
+
+        # a sampled share of requests runs under cProfile; those slower than the threshold are dumped
+        self.profile_rate = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+        self.profile_threshold = float(os.getenv('PROFILE_THRESHOLD_MS', 1_000))
+        self.profile_directory = os.getenv('PROFILE_DIR', 'resources/profiles/')
 
-        search_results = {}
-        for provider in self.search_result_providers:
-            search_results[provider.method] = provider.get_search_result(query)
+        # opened by open_response_cache once every artifact is written and the bundle is sealed
+        self.response_cache = None
 
-        label, score = self.classification.predict(query)
-        classification_result = search_pb2.ClassificationResponse(
+    def open_response_cache(self):
+        self.response_cache = ResponseCache.from_env(self.bundle.version)
+        if self.response_cache:
+            metrics.caches.register('responses', lambda: self.response_cache.stats)
+
+    def warmup(self, n):
+        # first calls pay for lazy allocations inside torch and the tokenizers, so they happen before serving
+        start = time.monotonic()
+        queries = sample_queries(self.bundle.load('corpus.text').tolist(), n, seed=1)
+        for query in queries:
+            self.run_stages(self.get_stages(query), None)
+
+        logger.info(f'Warmed up with {len(queries)} queries in {time.monotonic() - start:.1f}s.')
+
+    def get_classification_result(self, query) -> search_pb2.ClassificationResponse:
+        with tracing.span('classify'):
+            label, score = self.classification.predict(query)
+        return search_pb2.ClassificationResponse(
             items=[
                 search_pb2.ClassificationResponseItem(
                     id=1,
@@ -50,8 +120,9 @@ class SearchServer(search_pb2_grpc.SearchServicer):
             ]
         )
 
+    def get_cluster_result(self, query) -> search_pb2.ClusteringResponse:
         cid, (counts, labels) = self.clustering.predict_cluster(query)
-        cluster_result = search_pb2.ClusteringResponse(
+        return search_pb2.ClusteringResponse(
             cluster_id=cid,
             most_repeated_labels=[
                 search_pb2.ClusteringResponseItem(
@@ -62,29 +133,313 @@ class SearchServer(search_pb2_grpc.SearchServicer):
             ]
         )
 
-        important_names_result = search_pb2.ImportantNameResponse(
-            items=[
-                      search_pb2.ImportantNameResponseItem(
-                          id=i,
-                          name=name,
-                          type='شخصیت',
-                          page_rank=rank,
-                          hits_rank=hubs,
-                      ) for i, (name, rank, hubs) in enumerate(self.analyzer_chars.get_query_ranks(query))
-                  ] + [
-                      search_pb2.ImportantNameResponseItem(
-                          id=i,
-                          name=name,
-                          type='مکان',
-                          page_rank=rank,
-                          hits_rank=hubs,
-                      ) for i, (name, rank, hubs) in enumerate(self.analyzer_place.get_query_ranks(query))
-                  ]
-        )
+    @staticmethod
+    def get_important_names(analyzer, name_type, query) -> List[search_pb2.ImportantNameResponseItem]:
+        return [
+            search_pb2.ImportantNameResponseItem(
+                id=i,
+                name=name,
+                type=name_type,
+                page_rank=rank,
+                hits_rank=hubs,
+            ) for i, (name, rank, hubs) in enumerate(analyzer.get_query_ranks(query))
+        ]
+
+    def get_stages(self, query, max_results=None):
+        stages = {
+            provider.method: functools.partial(provider.get_search_result, query, max_results)
+            for provider in self.search_result_providers
+        }
+        stages['classification'] = functools.partial(self.get_classification_result, query)
+        stages['clustering'] = functools.partial(self.get_cluster_result, query)
+        stages['important_chars'] = functools.partial(self.get_important_names, self.analyzer_chars, 'شخصیت', query)
+        stages['important_places'] = functools.partial(self.get_important_names, self.analyzer_place, 'مکان', query)
+
+        return stages
+
+    @staticmethod
+    def timed(name, stage, trace=None):
+        # the trace is handed over explicitly, since executor threads do not share the request's context
+        def run():
+            with metrics.STAGES_IN_FLIGHT.labels(name).track_inprogress(), metrics.STAGE_SECONDS.labels(name).time(), \
+                    tracing.active(trace), tracing.stage(name):
+                return stage()
+
+        return run
+
+    @staticmethod
+    async def timed_async(name, coroutine, trace=None):
+        with metrics.STAGES_IN_FLIGHT.labels(name).track_inprogress(), metrics.STAGE_SECONDS.labels(name).time(), \
+                tracing.active(trace), tracing.stage(name, profile=False):
+            return await coroutine
+
+    def start_trace(self, request):
+        profile = self.profile_rate > 0 and random.random() < self.profile_rate
+        return tracing.Trace(profile) if request.debug or profile else None
+
+    def finish_trace(self, trace):
+        if trace is None or not trace.profile or trace.elapsed_ms < self.profile_threshold:
+            return
+
+        path = trace.dump_profile(self.profile_directory)
+        if path:
+            logger.warning(f'Request took {trace.elapsed_ms:.0f}ms, profile written to {path}.')
+
+    @staticmethod
+    def to_trace_spans(spans) -> List[search_pb2.TraceSpan]:
+        return [
+            search_pb2.TraceSpan(stage=stage, name=name, start_ms=start, duration_ms=duration)
+            for stage, name, start, duration in spans
+        ]
+
+    def get_deadline(self, name, start, remaining):
+        # each stage gets its own budget from the start of the request, capped by the client deadline
+        deadline = start + self.timeouts.get(name, self.default_timeout)
+        return deadline if remaining is None else min(deadline, start + remaining)
+
+    def iter_stages(self, stages, context, trace=None):
+        # yields (name, result) as stages finish; a stage that fails or runs out of time yields None
+        start = time.monotonic()
+        remaining = context.time_remaining() if context else None
+
+        pending, deadlines = {}, {}
+        for name, stage in stages.items():
+            future = self.executor.submit(self.timed(name, stage, trace))
+            pending[future] = name
+            deadlines[future] = self.get_deadline(name, start, remaining)
+
+        try:
+            while pending:
+                timeout = max(min(deadlines[future] for future in pending) - time.monotonic(), 0)
+                done, _ = futures.wait(pending, timeout=timeout, return_when=futures.FIRST_COMPLETED)
+
+                for future in done:
+                    name = pending.pop(future)
+                    try:
+                        result = future.result()
+                        metrics.STAGE_OUTCOMES.labels(name, 'ok').inc()
+                    except Exception:
+                        logger.exception(f'Stage {name} failed.')
+                        metrics.STAGE_OUTCOMES.labels(name, 'error').inc()
+                        result = None
+
+                    yield name, result
+
+                for future in [f for f in pending if deadlines[f] <= time.monotonic()]:
+                    name = pending.pop(future)
+                    future.cancel()
+                    logger.warning(f'Stage {name} timed out.')
+                    metrics.STAGE_OUTCOMES.labels(name, 'timeout').inc()
+                    yield name, None
+
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def run_stages(self, stages, context, trace=None):
+        return dict(self.iter_stages(stages, context, trace))
+
+    def select_stages(self, request):
+        if request.max_results > self.max_results:
+            raise ValueError(f'max_results must be at most {self.max_results}, got {request.max_results}')
+
+        # the response cache keys on the normalized query, so every stage has to see exactly that text
+        stages = self.get_stages(normalize_query(request.query), request.max_results or None)
+        if not request.methods and not request.sections:
+            return stages
+
+        methods = {provider.method for provider in self.search_result_providers}
+        unknown = (set(request.methods) - methods) | (set(request.sections) - set(SECTIONS))
+        if unknown:
+            raise ValueError(f'Unknown methods or sections: {", ".join(unknown)}')
+
+        selected = set(request.methods) | {stage for section in request.sections for stage in SECTIONS[section]}
+        return {name: stage for name, stage in stages.items() if name in selected}
 
-        return search_pb2.SearchResponse(
-            search_results=search_results,
-            classification=classification_result,
-            clustering=cluster_result,
-            important_names=important_names_result
+    def build_response(self, results) -> search_pb2.SearchResponse:
+        with tracing.span('protobuf'):
+            return self.to_search_response(results)
+
+    def to_search_response(self, results) -> search_pb2.SearchResponse:
+        response = search_pb2.SearchResponse(
+            search_results={
+                provider.method: results[provider.method] or search_pb2.DocumentResponse()
+                for provider in self.search_result_providers if provider.method in results
+            }
         )
+
+        if 'classification' in results:
+            response.classification.CopyFrom(results['classification'] or search_pb2.ClassificationResponse())
+        if 'clustering' in results:
+            response.clustering.CopyFrom(results['clustering'] or search_pb2.ClusteringResponse())
+        if 'important_chars' in results:
+            response.important_names.items.extend(
+                (results['important_chars'] or []) + (results['important_places'] or []))
+
+        return response
+
+    def cache_key(self, request):
+        # traced responses describe one particular run, so debug requests always run the stages
+        if self.response_cache is None or request.debug:
+            return None
+
+        return self.response_cache.key(normalize_query(request.query), sorted(request.methods),
+                                       sorted(request.sections), request.max_results)
+
+    def cached_response(self, key):
+        value = self.response_cache.get(key) if key else None
+        return search_pb2.SearchResponse.FromString(value) if value is not None else None
+
+    def cache_response(self, key, results, response):
+        # a stage that failed or timed out leaves a partial response, which is not worth repeating
+        if key and all(result is not None for result in results.values()):
+            self.response_cache.put(key, response.SerializeToString())
+
+    def build_section(self, name, result) -> search_pb2.SearchSection:
+        if name in {provider.method for provider in self.search_result_providers}:
+            return search_pb2.SearchSection(name=name, documents=result or search_pb2.DocumentResponse())
+        if name == 'classification':
+            return search_pb2.SearchSection(name=name, classification=result or search_pb2.ClassificationResponse())
+        if name == 'clustering':
+            return search_pb2.SearchSection(name=name, clustering=result or search_pb2.ClusteringResponse())
+
+        # characters and places stream as two sections, each named after its stage, so neither is mistaken for
+        # the complete important_names list
+        return search_pb2.SearchSection(
+            name=name, important_names=search_pb2.ImportantNameResponse(items=result or []))
+
+    def Retrieve(self, request, context) -> search_pb2.SearchResponse:
+        try:
+            stages = self.select_stages(request)
+        except ValueError as e:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+        key = self.cache_key(request)
+        response = self.cached_response(key)
+        if response is not None:
+            return response
+
+        trace = self.start_trace(request)
+        results = self.run_stages(stages, context, trace)
+        with tracing.active(trace):
+            response = self.build_response(results)
+
+        self.cache_response(key, results, response)
+        self.finish_trace(trace)
+        if request.debug:
+            response.trace.extend(self.to_trace_spans(trace.spans))
+
+        return response
+
+    def RetrieveStream(self, request, context):
+        try:
+            stages = self.select_stages(request)
+        except ValueError as e:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+        trace = self.start_trace(request)
+        for name, result in self.iter_stages(stages, context, trace):
+            if not context.is_active():
+                return
+
+            yield self.build_traced_section(request, trace, name, result)
+
+        self.finish_trace(trace)
+
+    def build_traced_section(self, request, trace, name, result) -> search_pb2.SearchSection:
+        start = time.perf_counter()
+        section = self.build_section(name, result)
+
+        if request.debug:
+            trace.add(name, 'section', start, time.perf_counter())
+            section.trace.extend(self.to_trace_spans(trace.stage_spans(name)))
+
+        return section
+
+
+class AsyncSearchServer(search_pb2_grpc.SearchServicer):
+    # I/O-bound stages are awaited on the event loop, CPU-bound ones run on the search server's executor
+    def __init__(self, search_server):
+        self.search_server = search_server
+        self.io_providers = {
+            provider.method: provider for provider in [search_result.AsyncElasticSearchResult()]
+        }
+
+    async def iter_stages(self, request, context, trace=None):
+        try:
+            stages = self.search_server.select_stages(request)
+        except ValueError as e:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+        loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        remaining = context.time_remaining()
+
+        pending, deadlines = {}, {}
+        for name, stage in stages.items():
+            if name in self.io_providers:
+                # awaited with the normalized query and limit the blocking stage was bound to
+                task = asyncio.ensure_future(self.search_server.timed_async(
+                    name, self.io_providers[name].get_search_result(*stage.args), trace))
+            else:
+                task = asyncio.ensure_future(
+                    loop.run_in_executor(self.search_server.executor, self.search_server.timed(name, stage, trace)))
+
+            pending[task] = name
+            deadlines[task] = self.search_server.get_deadline(name, start, remaining)
+
+        try:
+            while pending:
+                timeout = max(min(deadlines[task] for task in pending) - time.monotonic(), 0)
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    name = pending.pop(task)
+                    try:
+                        result = task.result()
+                        metrics.STAGE_OUTCOMES.labels(name, 'ok').inc()
+                    except Exception:
+                        logger.exception(f'Stage {name} failed.')
+                        metrics.STAGE_OUTCOMES.labels(name, 'error').inc()
+                        result = None
+
+                    yield name, result
+
+                for task in [t for t in pending if deadlines[t] <= time.monotonic()]:
+                    name = pending.pop(task)
+                    task.cancel()
+                    logger.warning(f'Stage {name} timed out.')
+                    metrics.STAGE_OUTCOMES.labels(name, 'timeout').inc()
+                    yield name, None
+
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def Retrieve(self, request, context) -> search_pb2.SearchResponse:
+        # sqlite may wait on another worker's write, so the cache is used off the event loop
+        loop = asyncio.get_running_loop()
+        key = self.search_server.cache_key(request)
+        response = await loop.run_in_executor(None, self.search_server.cached_response, key) if key else None
+        if response is not None:
+            return response
+
+        trace = self.search_server.start_trace(request)
+        results = {name: result async for name, result in self.iter_stages(request, context, trace)}
+        with tracing.active(trace):
+            response = self.search_server.build_response(results)
+
+        if key:
+            await loop.run_in_executor(None, self.search_server.cache_response, key, results, response)
+        self.search_server.finish_trace(trace)
+        if request.debug:
+            response.trace.extend(self.search_server.to_trace_spans(trace.spans))
+
+        return response
+
+    async def RetrieveStream(self, request, context):
+        trace = self.search_server.start_trace(request)
+        async for name, result in self.iter_stages(request, context, trace):
+            yield self.search_server.build_traced_section(request, trace, name, result)
+
+        self.search_server.finish_trace(trace)
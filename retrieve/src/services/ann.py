@@ -0,0 +1,111 @@
+import logging
+
+import numpy as np
+
+from services.ranking import top_k
+from services.store import StoredArrays
+
+logger = logging.getLogger(__name__)
+
+
+def batch_assign(vectors, centroids, n=10_000):
+    squared_norms = np.sum(centroids ** 2, axis=1)
+    return np.concatenate([
+        np.argmin(squared_norms - 2 * vectors[ndx:ndx + n].dot(centroids.T), axis=1)
+        for ndx in range(0, len(vectors), n)
+    ])
+
+
+def kmeans(vectors, k, max_iter=20, seed=0):
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].astype(np.float32)
+
+    for _ in range(max_iter):
+        assignment = batch_assign(vectors, centroids)
+        counts = np.bincount(assignment, minlength=k)
+
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        centroids[empty] = vectors[rng.choice(len(vectors), empty.sum())]
+
+    return centroids
+
+
+class IVFPQIndex(StoredArrays):
+    # nprobe (lists visited per query) and rerank (candidates re-scored exactly per result) trade recall for latency
+    fields = ['centroids', 'offsets', 'ids', 'codes', 'codebooks']
+
+    def __init__(self, centroids, offsets, ids, codes, codebooks, nprobe=8, rerank=4):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.ids = ids
+        self.codes = codes
+        self.codebooks = codebooks
+
+        self.nprobe = nprobe
+        self.rerank = rerank
+
+    @classmethod
+    def build(cls, vectors, n_lists=None, n_subspaces=16, n_codes=256, sample=50_000, seed=0, **kwargs):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        length, dim = vectors.shape
+
+        if dim % n_subspaces:
+            raise ValueError(f'Dimension {dim} is not divisible by {n_subspaces} subspaces.')
+
+        n_lists = n_lists or max(1, min(int(4 * np.sqrt(length)), length // 39))
+        rng = np.random.default_rng(seed)
+        training = vectors[rng.choice(length, min(sample, length), replace=False)]
+
+        logger.info(f'Training {n_lists} coarse lists over {length} vectors.')
+        centroids = kmeans(training, n_lists, seed=seed)
+        assignment = batch_assign(vectors, centroids)
+
+        residuals = vectors - centroids[assignment]
+        sub_dim = dim // n_subspaces
+
+        codebooks = np.zeros((n_subspaces, n_codes, sub_dim), dtype=np.float32)
+        codes = np.zeros((length, n_subspaces), dtype=np.uint8)
+
+        for m in range(n_subspaces):
+            subspace = residuals[:, m * sub_dim:(m + 1) * sub_dim]
+            codebooks[m] = kmeans(subspace[rng.choice(length, min(sample, length), replace=False)],
+                                  min(n_codes, length), seed=seed)
+            codes[:, m] = batch_assign(subspace, codebooks[m])
+
+        ids = np.argsort(assignment, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=n_lists))])
+
+        return cls(centroids, offsets, ids, codes[ids], codebooks, **kwargs)
+
+    def search(self, vector, n=5, vectors=None):
+        vector = np.squeeze(vector).astype(np.float32)
+        n_subspaces, _, sub_dim = self.codebooks.shape
+
+        # lists were assigned by L2 distance, so probe by -|q - c|^2 up to a constant
+        coarse = self.centroids.dot(vector)
+        probes = top_k(2 * coarse - np.sum(self.centroids ** 2, axis=1), self.nprobe)
+
+        # asymmetric distance: q.x ~= q.centroid + sum_m q_m.codebook_m[code_m]
+        tables = np.einsum('mcd,md->mc', self.codebooks, vector.reshape(n_subspaces, sub_dim))
+
+        lists = [np.arange(self.offsets[c], self.offsets[c + 1]) for c in probes]
+        positions = np.concatenate(lists)
+        if not len(positions):
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+
+        scores = np.repeat(coarse[probes], [len(lst) for lst in lists]) + \
+            tables[np.arange(n_subspaces), self.codes[positions]].sum(axis=1)
+
+        if vectors is None:
+            candidates = top_k(scores, n)
+            return self.ids[positions[candidates]], scores[candidates]
+
+        candidates = np.sort(self.ids[positions[top_k(scores, n * self.rerank)]])
+        exact = np.asarray(vectors[candidates]).dot(vector)
+        sorted_idx = top_k(exact, n)
+
+        return candidates[sorted_idx], exact[sorted_idx]
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import logging
+import os
+import time
+
+import hazm
+import numpy as np
+import pandas as pd
+
+from services.store import ArtifactStore
+
+logger = logging.getLogger(__name__)
+normalizer = hazm.Normalizer(token_based=True)
+
+BUNDLE_FORMAT = 1
+
+
+def file_sha256(path):
+    if not os.path.exists(path):
+        return None
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(2 ** 20), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+class Bundle(ArtifactStore):
+
+    def __init__(self, directory=None):
+        super().__init__(directory or os.getenv('BUNDLE_DIR', 'resources/bundle/'))
+        self.manifest = self.read_manifest()
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, 'manifest.json')
+
+    @property
+    def version(self):
+        return self.manifest['version'] if self.manifest else None
+
+    def read_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return None
+
+        with open(self.manifest_path, 'r') as file:
+            manifest = json.load(file)
+
+        if manifest.get('format') != BUNDLE_FORMAT:
+            logger.warning(f'Ignoring bundle manifest of format {manifest.get("format")}.')
+            return None
+
+        missing = [name for name in manifest['artifacts'] if name not in self]
+        if missing:
+            logger.warning(f'Bundle {manifest["version"]} is missing {", ".join(missing)}.')
+            return None
+
+        return manifest
+
+    def save(self, name, array):
+        super().save(name, array)
+
+        # any change to an artifact makes the sealed manifest stale
+        if self.manifest is not None:
+            os.remove(self.manifest_path)
+            self.manifest = None
+
+    def names(self):
+        return sorted(file_name[:-4] for file_name in os.listdir(self.directory) if file_name.endswith('.npy'))
+
+    def seal(self):
+        digest = hashlib.sha256()
+        artifacts = {}
+        for name in self.names():
+            with open(self.path(name), 'rb') as file:
+                for chunk in iter(lambda: file.read(2 ** 20), b''):
+                    digest.update(chunk)
+
+            array = self.load(name)
+            artifacts[name] = {'shape': list(array.shape), 'dtype': array.dtype.str}
+
+        self.manifest = {
+            'format': BUNDLE_FORMAT,
+            'version': digest.hexdigest()[:16],
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'artifacts': artifacts,
+        }
+
+        with open(f'{self.manifest_path}.tmp', 'w') as file:
+            json.dump(self.manifest, file, indent=2)
+        os.replace(f'{self.manifest_path}.tmp', self.manifest_path)
+
+        logger.info(f'Sealed bundle {self.version} with {len(artifacts)} artifacts.')
+        return self.manifest
+
+    def clear(self):
+        for name in self.names():
+            os.remove(self.path(name))
+
+        self.arrays.clear()
+        if self.manifest is not None:
+            os.remove(self.manifest_path)
+            self.manifest = None
+
+    def sources(self, paths, parameters):
+        # every file and setting the artifacts are derived from; a change to any of them starts an empty bundle
+        stamp = json.dumps({'files': {path: file_sha256(path) for path in paths}, 'parameters': parameters},
+                           sort_keys=True, ensure_ascii=False)
+
+        if 'sources' in self and self.load('sources').item() != stamp:
+            logger.warning('The sources of the bundle changed since it was built. Rebuilding it.')
+            self.clear()
+
+        if 'sources' not in self:
+            self.save('sources', np.array(stamp))
+
+    def corpus(self, path):
+        source = file_sha256(path)
+
+        # every other artifact is derived from the corpus, so a new corpus starts an empty bundle
+        if 'corpus.sha256' in self and self.load('corpus.sha256').item() != source:
+            logger.warning(f'{path} changed since the bundle was built. Rebuilding it.')
+            self.clear()
+
+        # normalized once at build time, in the original beyt order that link analysis depends on
+        if 'corpus.text' not in self:
+            df = pd.read_csv(path)
+            self.save('corpus.sha256', np.array(source))
+            self.save('corpus.text', np.array(df['text'].apply(normalizer.normalize).tolist(), dtype=str))
+            self.save('corpus.labels', np.array(df['labels'].tolist(), dtype=str))
+
+        return pd.DataFrame({'text': self.load('corpus.text'), 'labels': self.load('corpus.labels')}).astype(object)
@@ -0,0 +1,107 @@
+import sys
+import threading
+from collections import OrderedDict
+from concurrent import futures
+
+import numpy as np
+from scipy import sparse
+
+
+def size_of(value):
+    if sparse.issparse(value):
+        return value.data.nbytes + value.indices.nbytes + value.indptr.nbytes
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+    def put(self, key, value):
+        size = size_of(value)
+        if size > self.max_bytes:
+            return
+
+        # cached values are shared between requests, so nobody may modify them in place
+        if isinstance(value, np.ndarray):
+            value.flags.writeable = False
+
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+
+            self.entries[key] = (value, size)
+            self.size += size
+
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def get_or_compute(self, key, compute):
+        # concurrent misses on the same key wait for a single computation instead of repeating it
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key][0]
+
+            pending = self.pending.get(key)
+            if pending is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                self.pending[key] = futures.Future()
+
+        if pending is not None:
+            return pending.result()
+
+        try:
+            value = compute()
+            self.put(key, value)
+            self.pending[key].set_result(value)
+            return value
+
+        except Exception as e:
+            self.pending[key].set_exception(e)
+            raise
+
+        finally:
+            with self.lock:
+                self.pending.pop(key)
+
+    @property
+    def stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests else 0.0,
+                'entries': len(self.entries),
+                'bytes': self.size,
+            }
@@ -0,0 +1,154 @@
+import logging
+import random
+
+import numpy as np
+
+from services.spelling import CONFUSABLE, SpellingIndex
+from services.store import StoredArrays
+
+logger = logging.getLogger(__name__)
+
+EDIT_WEIGHTS = (1.0, 2.0, 3.0, 4.0, 6.0, 8.0)
+# used when the corpus is too small to hold anything out
+DEFAULTS = (4.0, 1.0, -1.5)
+
+
+def misspell(text, rng):
+    words = text.split()
+    if not words:
+        return text
+
+    i = rng.randrange(len(words))
+    word = words[i]
+    edit = rng.choice(['delete', 'swap', 'confuse', 'insert'])
+
+    if edit == 'confuse':
+        positions = [p for p, ch in enumerate(word) if any(ch in group for group in CONFUSABLE)]
+        if positions:
+            p = rng.choice(positions)
+            group = next(g for g in CONFUSABLE if word[p] in g)
+            word = word[:p] + rng.choice([c for c in group if c != word[p]]) + word[p + 1:]
+    elif edit == 'delete' and len(word) > 2:
+        p = rng.randrange(len(word))
+        word = word[:p] + word[p + 1:]
+    elif edit == 'swap' and len(word) > 2:
+        p = rng.randrange(len(word) - 1)
+        word = word[:p] + word[p + 1] + word[p] + word[p + 2:]
+    else:
+        p = rng.randrange(len(word) + 1)
+        word = word[:p] + rng.choice(word) + word[p:]
+
+    words[i] = word
+    return ' '.join(words)
+
+
+def make_samples(texts, n, seed):
+    # (intended mesra, misspelled query) pairs from beyts the index has not seen
+    rng = random.Random(seed)
+    mesras = [m.strip() for text in texts for m in text.split('-') if m.strip()]
+    return [(mesra, misspell(mesra, rng)) for mesra in rng.sample(mesras, min(n, len(mesras)))]
+
+
+def score_samples(index, samples, edit_weight, beam, candidates, smoothing):
+    # raw beam scores padded with -inf, and whether each rewrite is the intended mesra
+    scores = np.full((len(samples), beam), -np.inf)
+    labels = np.zeros((len(samples), beam), dtype=bool)
+    for row, (intended, query) in enumerate(samples):
+        for col, (expanded, score) in enumerate(index.rewrites(query, beam, candidates, edit_weight, smoothing)):
+            scores[row, col] = score
+            labels[row, col] = expanded == intended
+
+    return scores, labels
+
+
+def evaluate(scores, labels, temperature, outside, k, bins=10):
+    # the same confidences as spelling.confidences, for every sample at once
+    found = np.isfinite(scores)
+    best = np.where(found.any(axis=1), scores.max(axis=1), 0)[:, None]
+    weights = np.where(found, np.exp((scores - best) / temperature), 0)
+    weights = weights / (weights.sum(axis=1, keepdims=True) + np.exp(outside))
+
+    predicted = np.clip(weights[:, :k][found[:, :k]], 1e-9, 1 - 1e-9)
+    correct = labels[:, :k][found[:, :k]].astype(float)
+    log_loss = -np.mean(correct * np.log(predicted) + (1 - correct) * np.log(1 - predicted))
+
+    # expected calibration error: how far confidence is from accuracy, weighted over equal-width bins
+    which = np.minimum((predicted * bins).astype(int), bins - 1)
+    ece = sum(abs(predicted[which == b].mean() - correct[which == b].mean()) * np.mean(which == b)
+              for b in range(bins) if np.any(which == b))
+
+    hit = labels[:, :k].any(axis=1)
+    first = np.argmax(labels[:, :k], axis=1)[hit]
+    return {
+        'log_loss': float(log_loss),
+        'ece': float(ece),
+        **{f'accuracy@{i + 1}': float(np.sum(first <= i) / len(scores)) for i in range(k)},
+    }
+
+
+def fit(texts, beam=8, candidates=5, smoothing=50.0, rewrites=3, edit_weights=EDIT_WEIGHTS, samples=1_000,
+        holdout=0.1, seed=0):
+    # fits the edit weight, temperature and outside weight on misspelled mesras of beyts held out of the index;
+    # a plain softmax (no weight outside the beam) is the baseline the fitted confidences are compared to
+    texts = list(texts)
+    random.Random(seed).shuffle(texts)
+    split = int(len(texts) * (1 - holdout))
+    samples = make_samples(texts[split:], samples, seed)
+    if not samples:
+        return []
+
+    index = SpellingIndex.from_texts(texts[:split])
+    grid = [(t, o) for t in np.geomspace(0.1, 10, 41) for o in np.linspace(-6, 2, 33)]
+
+    results = []
+    for edit_weight in edit_weights:
+        scores, labels = score_samples(index, samples, edit_weight, beam, candidates, smoothing)
+        temperature, outside = min(grid, key=lambda p: evaluate(scores, labels, *p, rewrites)['log_loss'])
+        results.append({
+            'edit_weight': float(edit_weight),
+            'temperature': float(temperature),
+            'outside': float(outside),
+            'samples': len(samples),
+            'uncalibrated': evaluate(scores, labels, 1.0, -np.inf, rewrites),
+            'calibrated': evaluate(scores, labels, temperature, outside, rewrites),
+        })
+
+    return results
+
+
+def best(results):
+    return max(results, key=lambda r: (r['calibrated']['accuracy@1'], -r['calibrated']['log_loss']))
+
+
+class ExpansionCalibration(StoredArrays):
+    # the fitted (edit weight, temperature, outside) and the (beam, candidates, smoothing, rewrites) it was fitted for
+    fields = ['parameters', 'settings']
+
+    def __init__(self, parameters, settings):
+        self.parameters = parameters
+        self.settings = settings
+        self.edit_weight, self.temperature, self.outside = (float(p) for p in parameters)
+
+    @classmethod
+    def load_or_fit(cls, store, texts, beam, candidates, smoothing, rewrites, name='expansion.calibration'):
+        settings = np.array([beam, candidates, smoothing, rewrites], dtype=np.float64)
+        if cls.exists(store, name):
+            calibration = cls.load(store, name)
+            if np.array_equal(calibration.settings, settings):
+                return calibration
+            logger.warning('Expansion settings changed since the confidences were fitted. Fitting them again.')
+
+        results = fit(texts, beam, candidates, smoothing, rewrites)
+        if not results:
+            logger.warning('Too few beyts to calibrate the expansion confidences, using the defaults.')
+            return cls(np.array(DEFAULTS), settings)
+
+        chosen = best(results)
+        logger.info(f'Calibrated Expand on {chosen["samples"]} held-out misspellings: '
+                    f'edit weight {chosen["edit_weight"]:g}, temperature {chosen["temperature"]:.3f}, '
+                    f'outside {chosen["outside"]:.2f}, accuracy@1 {chosen["calibrated"]["accuracy@1"]:.3f}, '
+                    f'ece {chosen["calibrated"]["ece"]:.3f} (softmax {chosen["uncalibrated"]["ece"]:.3f}).')
+
+        calibration = cls(np.array([chosen['edit_weight'], chosen['temperature'], chosen['outside']]), settings)
+        calibration.save(store, name)
+        return calibration
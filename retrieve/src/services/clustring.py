@@ -5,12 +5,14 @@ import pandas as pd
 import numpy as np
 import logging
 import pickle
-import tqdm
 import os
 from sklearn.decomposition import PCA
 
 from sklearn.cluster import KMeans
-from transformers import AutoTokenizer, AutoModel, AutoConfig
+
+from services.encoder import sample_queries
+from services import tracing
+from services.registry import registry
 
 # sns.set()
 logger = logging.getLogger(__name__)
@@ -19,64 +21,106 @@ normalizer = hazm.Normalizer(token_based=True)
 
 class Clustering:
 
-    def __init__(self, dataset, k, pca_dim=8, max_iter=2_000, _checkpoint=None):
+    fields = ['pca.mean', 'pca.components', 'kmeans.centroids', 'kmeans.labels']
 
-        model_name = 'HooshvareLab/bert-base-parsbert-uncased'
-        self.tokenizer = AutoTokenizer.from_pretrained(
-            model_name, local_files_only=True)
-        self.embedder = AutoModel.from_pretrained(
-            model_name, local_files_only=True, config=AutoConfig.from_pretrained(model_name))
+    def __init__(self, dataset, k, pca_dim=8, max_iter=2_000, _checkpoint=None, store=None, normalized=False):
 
         self.directory = _checkpoint
+        self.store = store
         self.dataset = dataset.sort_values('text')
-        self.dataset['text'] = self.dataset['text'].apply(normalizer.normalize)
+        if not normalized:
+            self.dataset['text'] = self.dataset['text'].apply(normalizer.normalize)
 
-        try:
+        if store is not None and all(field in store for field in self.fields):
+            self.mean, self.components, self.centroids, self.labels = (store.load(field) for field in self.fields)
 
-            self.load_pca()
-            self.load_kmeans()
-            self.dataset['cluster_id'] = self.labels
-            self.cluster_labels = self.generate_cluster_labels()
-            return
+        else:
+            if not self.load_checkpoint():
+                texts = self.dataset['text'].tolist()
+                self.embeddings = self.get_transformer_embeddings(texts)
 
-        except:
-            logger.warning('It is not possible to load models. Again the models are trained.')
+                self.pca = PCA(n_components=pca_dim)
+                self.embeddings = self.pca.fit_transform(self.embeddings)
 
-        texts = self.dataset['text'].tolist()
-        self.embeddings = self.get_transformer_embeddings(texts)
+                self.kmeans = KMeans(n_clusters=k, max_iter=max_iter)
+                self.labels = self.kmeans.fit_predict(self.embeddings)
 
-        self.pca = PCA(n_components=pca_dim)
-        self.embeddings = self.pca.fit_transform(self.embeddings)
+                if store is None:
+                    self.directory = '../../resources/clustering/'
+                    if not os.path.exists(self.directory):
+                        os.mkdir(self.directory)
 
-        self.kmeans = KMeans(n_clusters=k, max_iter=max_iter)
-        self.labels = self.kmeans.fit_predict(self.embeddings)
+                    self.save_pca()
+                    self.save_kmeans()
 
-        self.directory = '../../resources/clustering/'
-        if not os.path.exists(self.directory):
-            os.mkdir(self.directory)
+            self.set_parameters()
 
-        self.save_pca()
-        self.save_kmeans()
         self.dataset['cluster_id'] = self.labels
         self.cluster_labels = self.generate_cluster_labels()
 
+        # outside of any fallback: a failing quantization or registry is an error, not a reason to retrain
+        self.check_quantized_encoder()
+
+    def load_checkpoint(self):
+        # only a missing or unreadable checkpoint means training again, anything else is a bug that should surface
+        if self.directory is None:
+            return False
+
+        try:
+            self.load_pca()
+            self.load_kmeans()
+            return True
+
+        except (FileNotFoundError, pickle.UnpicklingError, EOFError):
+            logger.warning('It is not possible to load models. Again the models are trained.')
+            return False
+
+    def set_parameters(self):
+        # only the fitted arrays are needed at query time; a store keeps them as mmapped npy files
+        self.mean = self.pca.mean_.astype(np.float32)
+        self.components = self.pca.components_.astype(np.float32)
+        self.centroids = self.kmeans.cluster_centers_.astype(np.float32)
+
+        if self.store is not None:
+            for field, array in zip(self.fields, [self.mean, self.components, self.centroids, self.labels]):
+                self.store.save(field, array)
+
+    def reduce(self, embeddings):
+        return (embeddings - self.mean).dot(self.components.T)
+
+    def assign(self, reduced):
+        distances = (reduced ** 2).sum(axis=1)[:, None] - 2 * reduced.dot(self.centroids.T) + \
+                    (self.centroids ** 2).sum(axis=1)[None, :]
+        return distances.argmin(axis=1)
+
     def generate_cluster_labels(self):
         return self.dataset.groupby(['cluster_id', 'labels'])['text'] \
             .agg(['count']).sort_values('count', ascending=False).reset_index() \
             .groupby('cluster_id').apply(lambda x: (list(x['count']), list(x['labels'])))
 
     @staticmethod
-    def _batch_series(iterable, n=2_000):
-        for ndx in range(0, len(iterable), n): yield iterable[ndx:min(ndx + n, len(iterable))]
+    def get_transformer_embeddings(documents):
+        return registry.encoder().encode(documents)
 
-    def get_transformer_embeddings(self, documents):
-        result = None
-        for batch in tqdm.tqdm(self._batch_series(documents, 1_000)):
-            output = self.embedder(**self.tokenizer(batch, return_tensors='pt', padding=True))
-            output = np.mean(output.last_hidden_state.detach().numpy(), axis=1)
-            result = np.concatenate((result, output)) if result is not None else output
+    @staticmethod
+    def get_query_embeddings(documents):
+        return registry.query_encoder().encode(documents)
+
+    def check_quantized_encoder(self):
+        if registry.query_encoder() is registry.encoder():
+            return
+
+        queries = sample_queries(self.dataset['text'].tolist())
+        agreement = np.mean(
+            self.assign(self.reduce(registry.encoder().encode(queries))) ==
+            self.assign(self.reduce(registry.query_encoder().encode(queries))))
+
+        if agreement < float(os.getenv('QUANTIZED_MIN_AGREEMENT', 0.9)):
+            logger.warning(f'Quantized encoder agrees on {agreement:.2%} of the clusters. Fall back to fp32.')
+            registry.reject_quantized()
+            return
 
-        return result
+        logger.info(f'Quantized encoder agrees on {agreement:.2%} of the clusters.')
 
     def load_pca(self):
         self.pca = pickle.load(
@@ -103,9 +147,10 @@ class Clustering:
             self.labels, open(os.path.join(self.directory, 'kmeans_labels.dump'), 'wb'))
 
     def predict_cluster(self, element):
-        embedding = self.get_transformer_embeddings([element])
-        embedding = self.pca.transform(embedding)
-        cluster_id = self.kmeans.predict(embedding)[0]
+        # same cache key as Similarities' sentence embeddings, so the query is encoded once for both
+        embedding = registry.embed_query('transformer_embeddings', element, self.get_query_embeddings)
+        with tracing.span('assign'):
+            cluster_id = int(self.assign(self.reduce(embedding))[0])
         return cluster_id, self.cluster_labels[cluster_id]
 
     # def plot_clusters(self, n=1_000):
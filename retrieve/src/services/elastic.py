@@ -1,6 +1,39 @@
 from pprint import pprint
 
-from elasticsearch import Elasticsearch
+from elasticsearch import AsyncElasticsearch, Elasticsearch
+
+from services import tracing
+from services.metrics import ELASTIC_SECONDS
+
+
+def fuzzy_match(field, text):
+    return {
+        'match': {
+            field: {
+                'query': text,
+                'fuzziness': 'AUTO',
+            }
+        }
+    }
+
+
+def first_word(results):
+    return results[0]['_source']['word'] if len(results) > 0 else None
+
+
+def word_searches(words):
+    # msearch bodies alternate a header (the index is given once for all of them) and a query
+    return [part for word in words for part in ({}, {'query': fuzzy_match('search_field', word)})]
+
+
+def first_words(words, results):
+    found = {}
+    for word, response in zip(words, results['responses']):
+        if 'error' in response:
+            raise RuntimeError(f'Looking up {word} failed: {response["error"]}')
+        found[word] = first_word(response['hits']['hits'])
+
+    return found
 
 
 class ElasticSearchQuery:
@@ -8,24 +41,51 @@ class ElasticSearchQuery:
     def __init__(self, es_host):
         self.es = Elasticsearch(hosts=es_host)
 
-    def search(self, query):
-        return self.es.search(index='ferdosi', query={
-            'match': {
-                'beyt': {
-                    'query': query,
-                    'fuzziness': 'AUTO',
-                }
-            }
-        })
+    def search(self, query, size=None):
+        with ELASTIC_SECONDS.labels('search').time(), tracing.span('elasticsearch'):
+            return self.es.search(index='ferdosi', size=size, query=fuzzy_match('beyt', query))
 
     def find_word(self, word):
-        results = self.es.search(index='words', query={
-            'match': {
-                'search_field': {
-                    'query': word,
-                    'fuzziness': 'AUTO',
-                }
-            }
-        })['hits']['hits']
+        with ELASTIC_SECONDS.labels('find_word').time(), tracing.span('elasticsearch'):
+            results = self.es.search(index='words', query=fuzzy_match('search_field', word))
+
+        return first_word(results['hits']['hits'])
+
+    def find_words(self, words):
+        # every distinct word is looked up in a single round trip
+        unique = list(dict.fromkeys(words))
+        if not unique:
+            return []
+
+        with ELASTIC_SECONDS.labels('find_words').time(), tracing.span('elasticsearch'):
+            results = self.es.msearch(index='words', searches=word_searches(unique))
+
+        found = first_words(unique, results)
+        return [found[word] for word in words]
+
+
+class AsyncElasticSearchQuery:
+
+    def __init__(self, es_host):
+        self.es = AsyncElasticsearch(hosts=es_host)
+
+    async def search(self, query, size=None):
+        with ELASTIC_SECONDS.labels('search').time(), tracing.span('elasticsearch'):
+            return await self.es.search(index='ferdosi', size=size, query=fuzzy_match('beyt', query))
+
+    async def find_word(self, word):
+        with ELASTIC_SECONDS.labels('find_word').time(), tracing.span('elasticsearch'):
+            results = await self.es.search(index='words', query=fuzzy_match('search_field', word))
+
+        return first_word(results['hits']['hits'])
+
+    async def find_words(self, words):
+        unique = list(dict.fromkeys(words))
+        if not unique:
+            return []
+
+        with ELASTIC_SECONDS.labels('find_words').time(), tracing.span('elasticsearch'):
+            results = await self.es.msearch(index='words', searches=word_searches(unique))
 
-        return results[0]['_source']['word'] if len(results) > 0 else None
+        found = first_words(unique, results)
+        return [found[word] for word in words]
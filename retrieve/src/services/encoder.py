@@ -0,0 +1,82 @@
+import copy
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+import torch
+
+from services.ranking import normalize_rows, top_k
+
+logger = logging.getLogger(__name__)
+
+
+class TransformerEncoder:
+
+    def __init__(self, tokenizer, model, batch_size=None, num_threads=None):
+        self.tokenizer = tokenizer
+        self.model = model.eval()
+        self.batch_size = batch_size or int(os.getenv('ENCODER_BATCH_SIZE', 64))
+
+        num_threads = num_threads or int(os.getenv('ENCODER_THREADS', 0))
+        if num_threads:
+            torch.set_num_threads(num_threads)
+
+        self.tokens = 0
+        self.seconds = 0.0
+        self.lock = threading.Lock()
+
+    def quantized(self):
+        model = torch.quantization.quantize_dynamic(copy.deepcopy(self.model), {torch.nn.Linear}, dtype=torch.qint8)
+        return TransformerEncoder(self.tokenizer, model, self.batch_size)
+
+    @property
+    def tokens_per_second(self):
+        return self.tokens / self.seconds if self.seconds else 0.0
+
+    def encode(self, texts):
+        encoded = self.tokenizer(list(texts), truncation=True)
+        lengths = np.array([len(ids) for ids in encoded['input_ids']])
+
+        # similar lengths share a batch, so padding stays close to the real token count
+        order = np.argsort(lengths, kind='stable')
+        embeddings = np.zeros((len(lengths), self.model.config.hidden_size), dtype=np.float32)
+
+        start = time.perf_counter()
+        with torch.inference_mode():
+            for ndx in range(0, len(order), self.batch_size):
+                batch = order[ndx:ndx + self.batch_size]
+                features = self.tokenizer.pad(
+                    {key: [values[i] for i in batch] for key, values in encoded.items()}, return_tensors='pt')
+
+                output = self.model(**features).last_hidden_state
+                mask = features['attention_mask'].unsqueeze(-1).to(output.dtype)
+                embeddings[batch] = ((output * mask).sum(dim=1) / mask.sum(dim=1)).numpy()
+
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.tokens += int(lengths.sum())
+            self.seconds += elapsed
+
+        if len(lengths) > self.batch_size:
+            logger.info(f'Encoded {len(lengths)} texts at {lengths.sum() / elapsed:.0f} tokens/sec.')
+
+        return embeddings
+
+
+def sample_queries(texts, n=64, seed=0):
+    # the first mesra of a beyt is a held-out query that never equals a whole document
+    sample = np.random.default_rng(seed).choice(len(texts), min(n, len(texts)), replace=False)
+    return [texts[i].split('-')[0].strip() for i in sample]
+
+
+def ranking_agreement(reference, candidate, queries, documents, n=10):
+    expected = normalize_rows(reference.encode(queries))
+    actual = normalize_rows(candidate.encode(queries))
+
+    overlaps = [
+        len(set(top_k(documents.dot(e), n)) & set(top_k(documents.dot(a), n))) / n
+        for e, a in zip(expected, actual)
+    ]
+    return float(np.mean(overlaps))
@@ -0,0 +1,52 @@
+import numpy as np
+from scipy import sparse
+
+from services import tracing
+from services.ranking import top_k
+from services.store import StoredArrays
+
+
+class InvertedIndex(StoredArrays):
+    fields = ['indptr', 'indices', 'data', 'norms']
+
+    def __init__(self, indptr, indices, data, norms):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.norms = norms
+
+    @classmethod
+    def from_matrix(cls, matrix):
+        # documents x terms -> terms x documents, so each column slice is a posting list
+        matrix = sparse.csc_matrix(matrix, dtype=np.float32)
+        matrix.sort_indices()
+
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel()).astype(np.float32)
+        return cls(matrix.indptr, matrix.indices, matrix.data, norms)
+
+    def __len__(self):
+        return len(self.norms)
+
+    def postings(self, term):
+        start, end = self.indptr[term], self.indptr[term + 1]
+        return self.indices[start:end], self.data[start:end]
+
+    def search(self, vector, n=5):
+        vector = sparse.csr_matrix(vector)
+
+        documents, scores = [], []
+        for term, weight in zip(vector.indices, vector.data):
+            ids, weights = self.postings(term)
+            documents.append(ids)
+            scores.append(weights * weight)
+
+        if not documents:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+
+        documents, inverse = np.unique(np.concatenate(documents), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(scores))
+        scores = scores / (self.norms[documents] * np.linalg.norm(vector.data) + 1e-10)
+
+        with tracing.span('top_k'):
+            sorted_idx = top_k(scores, n)
+        return documents[sorted_idx], scores[sorted_idx]
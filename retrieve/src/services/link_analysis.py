@@ -5,40 +5,60 @@ import networkx as nx
 import pandas as pd
 import numpy as np
 
-normalizer = hazm.Normalizer(token_based=True)
-
+from services import tracing
+from services.store import StoredArrays
 
-class LinkDocumentsAnalyzer:
+normalizer = hazm.Normalizer(token_based=True)
 
-    def __init__(self, document, elements, threshold, window_size):
 
-        document = document.apply(normalizer.normalize)
-        elements = elements.apply(normalizer.normalize)
+class LinkDocumentsAnalyzer(StoredArrays):
 
-        positions, filtered_elements = self.create_position_matrix(document, elements, threshold)
+    fields = ['elements', 'rank', 'hubs', 'authorities']
 
-        self.id2element = dict(enumerate(filtered_elements))
+    def __init__(self, document, elements, threshold, window_size, store=None, name=None):
 
-        adjacency_matrix = self.create_adjacency_matrix(positions, window_size)
+        if store is not None and self.exists(store, name):
+            elements, rank, hubs, authorities = self.load_arrays(store, name)
+        else:
+            elements, rank, hubs, authorities = self.build(document, elements, threshold, window_size)
+            if store is not None:
+                self.save_arrays(store, name, [elements, rank, hubs, authorities])
 
-        self.graph = nx.from_numpy_matrix(adjacency_matrix)
+        self.id2element = dict(enumerate(elements))
 
-        self.pagerank = pd.DataFrame([
-            {'element': self.id2element[k], 'rank': v} for k, v in nx.pagerank_numpy(self.graph, alpha=0.9).items()
-        ])
+        self.pagerank = pd.DataFrame({'element': elements, 'rank': rank})
         self.pagerank = self.pagerank.sort_values('rank', ascending=False)
 
-        hubs, authorities = nx.hits(self.graph, max_iter=1e3)
-
-        self.hitsrank = pd.DataFrame([
-            {'element': self.id2element[k], 'hubs': vh, 'authorities': va}
-            for (k, vh), (_, va) in zip(hubs.items(), authorities.items())
-        ])
+        self.hitsrank = pd.DataFrame({'element': elements, 'hubs': hubs, 'authorities': authorities})
         self.hitsrank = self.hitsrank.sort_values('hubs', ascending=False)
 
         self.merged = pd.merge(self.pagerank, self.hitsrank, left_on='element', right_on='element')
         self.merged = self.merged[['element', 'rank', 'hubs']]
 
+    @classmethod
+    def build(cls, document, elements, threshold, window_size):
+
+        document = document.apply(normalizer.normalize)
+        elements = elements.apply(normalizer.normalize)
+
+        positions, filtered_elements = cls.create_position_matrix(document, elements, threshold)
+
+        adjacency_matrix = cls.create_adjacency_matrix(positions, window_size)
+
+        graph = nx.from_numpy_matrix(adjacency_matrix)
+
+        pagerank = nx.pagerank_numpy(graph, alpha=0.9)
+        hubs, authorities = nx.hits(graph, max_iter=1e3)
+
+        # one row per element, in the graph's node order
+        nodes = range(len(filtered_elements))
+        return (
+            np.array(filtered_elements.tolist(), dtype=str),
+            np.array([pagerank[k] for k in nodes]),
+            np.array([hubs[k] for k in nodes]),
+            np.array([authorities[k] for k in nodes]),
+        )
+
     @staticmethod
     def create_position_matrix(documents, elements, threshold):
 
@@ -85,9 +105,10 @@ class LinkDocumentsAnalyzer:
 
     def get_query_ranks(self, query):
         matches = []
-        for regex, rank, hubs in self.merged.to_records(index=False):
-            if re.search(regex, query):
-                matches.append((regex.split('|')[0], rank, hubs))
+        with tracing.span('match'):
+            for regex, rank, hubs in self.merged.to_records(index=False):
+                if re.search(regex, query):
+                    matches.append((regex.split('|')[0], rank, hubs))
 
         return matches
 
@@ -0,0 +1,58 @@
+import logging
+import os
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+from prometheus_client.core import REGISTRY, CounterMetricFamily, GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+RPC_SECONDS = Histogram('retrieve_rpc_seconds', 'Time spent handling an RPC.', ['method'], buckets=BUCKETS)
+RPC_IN_FLIGHT = Gauge('retrieve_rpc_in_flight', 'RPCs currently being handled.', ['method'])
+RPC_ERRORS = Counter('retrieve_rpc_errors_total', 'RPCs that ended with an exception.', ['method'])
+
+STAGE_SECONDS = Histogram('retrieve_stage_seconds', 'Time spent in a Retrieve stage.', ['stage'], buckets=BUCKETS)
+STAGE_OUTCOMES = Counter('retrieve_stage_total', 'Retrieve stages by outcome.', ['stage', 'outcome'])
+STAGES_IN_FLIGHT = Gauge('retrieve_stages_in_flight', 'Retrieve stages currently running.', ['stage'])
+
+ELASTIC_SECONDS = Histogram('retrieve_elasticsearch_seconds', 'Time spent in Elasticsearch calls.', ['operation'],
+                            buckets=BUCKETS)
+
+
+class CacheCollector:
+    # reads the counters the caches keep anyway, so lookups stay free of metric updates
+    def __init__(self):
+        self.caches = {}
+
+    def register(self, name, stats):
+        self.caches[name] = stats
+
+    def collect(self):
+        hits = CounterMetricFamily('retrieve_cache_hits', 'Cache hits.', labels=['cache'])
+        misses = CounterMetricFamily('retrieve_cache_misses', 'Cache misses.', labels=['cache'])
+        ratio = GaugeMetricFamily('retrieve_cache_hit_ratio', 'Share of lookups served by the cache.', labels=['cache'])
+        entries = GaugeMetricFamily('retrieve_cache_entries', 'Entries held by the cache.', labels=['cache'])
+
+        for name, stats in self.caches.items():
+            values = stats()
+            requests = values['hits'] + values['misses']
+            hits.add_metric([name], values['hits'])
+            misses.add_metric([name], values['misses'])
+            ratio.add_metric([name], values['hits'] / requests if requests else 0.0)
+            entries.add_metric([name], values['entries'])
+
+        yield from [hits, misses, ratio, entries]
+
+
+caches = CacheCollector()
+REGISTRY.register(caches)
+
+
+def serve_metrics(port=None):
+    port = int(port if port is not None else os.getenv('METRICS_PORT', 9102))
+    if not port:
+        return
+
+    start_http_server(port, addr=os.getenv('METRICS_ADDR', '127.0.0.1'))
+    logger.info(f'Serving metrics on port {port}.')
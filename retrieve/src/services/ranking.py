@@ -0,0 +1,17 @@
+import numpy as np
+
+
+def top_k(scores, n):
+    # argpartition(scores, -0) would take the whole array
+    if n <= 0:
+        return np.array([], dtype=int)
+
+    if n >= len(scores):
+        return np.argsort(scores)[::-1]
+
+    candidates = np.argpartition(scores, -n)[-n:]
+    return candidates[np.argsort(scores[candidates])[::-1]]
+
+
+def normalize_rows(matrix):
+    return matrix / (np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-10)
@@ -0,0 +1,87 @@
+import functools
+import logging
+import os
+import threading
+
+import hazm
+from gensim.models import KeyedVectors
+from transformers import AutoTokenizer, AutoConfig, AutoModel
+
+from services.cache import LRUCache
+from services.classification import get_classifier
+from services.encoder import TransformerEncoder
+from services.metrics import caches
+from services import tracing
+
+logger = logging.getLogger(__name__)
+normalizer = hazm.Normalizer(token_based=True)
+normalize_query = functools.lru_cache(maxsize=4_096)(normalizer.normalize)
+
+PARSBERT = 'HooshvareLab/bert-base-parsbert-uncased'
+
+
+class ModelRegistry:
+
+    def __init__(self):
+        self.models = {}
+        self.rejected_quantized = set()
+        self.lock = threading.RLock()
+
+        self.query_cache = LRUCache(int(os.getenv('QUERY_CACHE_BYTES', 64 * 2 ** 20)))
+
+    def get(self, key, loader):
+        with self.lock:
+            if key not in self.models:
+                logger.info(f'Loading {key[0]} {key[1]}.')
+                self.models[key] = loader()
+
+            return self.models[key]
+
+    def tokenizer(self, name=PARSBERT):
+        return self.get(('tokenizer', name), lambda: AutoTokenizer.from_pretrained(name))
+
+    def transformer(self, name=PARSBERT):
+        return self.get(('transformer', name), lambda: AutoModel.from_pretrained(
+            name, config=AutoConfig.from_pretrained(name)))
+
+    def encoder(self, name=PARSBERT):
+        return self.get(('encoder', name), lambda: TransformerEncoder(self.tokenizer(name), self.transformer(name)))
+
+    def query_encoder(self, name=PARSBERT):
+        if os.getenv('QUANTIZED_INFERENCE', '0') != '1' or name in self.rejected_quantized:
+            return self.encoder(name)
+
+        return self.get(('quantized encoder', name), lambda: self.encoder(name).quantized())
+
+    def reject_quantized(self, name=PARSBERT):
+        with self.lock:
+            self.rejected_quantized.add(name)
+
+    def word2vec(self, path):
+        return self.get(('word2vec', path), lambda: KeyedVectors.load_word2vec_format(path))
+
+    def classifier(self, checkpoint):
+        return self.get(('classifier', checkpoint), lambda: get_classifier(checkpoint))
+
+    def embed_query(self, name, text, embedder):
+        # every consumer of the same embedding family reuses a single computation per normalized query
+        with tracing.span('normalize'):
+            text = normalize_query(text)
+
+        def encode():
+            with tracing.span('encode'):
+                return embedder([text])
+
+        return self.query_cache.get_or_compute((name, text), encode)
+
+
+registry = ModelRegistry()
+
+
+def normalize_query_stats():
+    info = normalize_query.cache_info()
+    return {'hits': info.hits, 'misses': info.misses, 'entries': info.currsize}
+
+
+caches.register('query_embeddings', lambda: registry.query_cache.stats)
+caches.register('normalized_queries', normalize_query_stats)
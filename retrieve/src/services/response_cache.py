@@ -0,0 +1,154 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    version TEXT NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+)
+'''
+
+
+class ResponseCache:
+    # one sqlite file shared by every worker process; entries belong to the bundle version that produced them
+
+    def __init__(self, path, version, max_bytes, ttl):
+        self.path = path
+        self.version = version
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self.local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.entries = 0
+        self.size = 0
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        with self.connection() as db:
+            db.execute(SCHEMA)
+            db.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+            removed = db.execute('DELETE FROM responses WHERE version != ?', (version,)).rowcount
+
+        if removed:
+            logger.info(f'Dropped {removed} cached responses of older bundles.')
+
+    @classmethod
+    def from_env(cls, version):
+        max_bytes = int(os.getenv('RESPONSE_CACHE_BYTES', 256 * 2 ** 20))
+        if not max_bytes:
+            return None
+
+        if not version:
+            logger.info('Response cache is off until the bundle is sealed.')
+            return None
+
+        return cls(os.getenv('RESPONSE_CACHE_PATH', 'resources/response_cache.sqlite'), version, max_bytes,
+                   float(os.getenv('RESPONSE_CACHE_TTL', 3_600)))
+
+    def connection(self):
+        # sqlite connections cannot be shared between threads, so every thread opens its own
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self.local.db = db
+
+        return db
+
+    def key(self, *parts):
+        return hashlib.sha256(json.dumps([self.version, *parts], ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        try:
+            row = self.connection().execute(
+                'SELECT value, accessed FROM responses WHERE key = ? AND created > ?', (key, now - self.ttl)).fetchone()
+        except sqlite3.Error as e:
+            # a busy or broken cache only costs a recomputation
+            logger.warning(f'Response cache lookup failed: {e}')
+            row = None
+
+        with self.lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        # the access time only drives eviction, so hot keys do not need a write on every hit
+        if now - row[1] > 1:
+            try:
+                self.connection().execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+            except sqlite3.Error:
+                pass
+
+        return row[0]
+
+    def put(self, key, value):
+        size = len(value)
+        if size > self.max_bytes:
+            return
+
+        try:
+            self.insert(key, value, size)
+        except sqlite3.Error as e:
+            logger.warning(f'Response cache write failed: {e}')
+
+    def insert(self, key, value, size):
+        now = time.time()
+        db = self.connection()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                       (key, self.version, value, size, now, now))
+            db.execute('DELETE FROM responses WHERE created <= ?', (now - self.ttl,))
+            db.execute('''
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM (
+                        SELECT key, SUM(size) OVER (ORDER BY accessed DESC, key) AS total FROM responses
+                    ) WHERE total > ?
+                )''', (self.max_bytes,))
+            db.execute('COMMIT')
+
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+
+    @property
+    def stats(self):
+        # read on every metrics scrape; while another worker holds the database the last known counts are reported
+        try:
+            entries, size = self.connection().execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f'Response cache stats failed: {e}')
+            entries, size = None, None
+
+        with self.lock:
+            if entries is not None:
+                self.entries, self.size = entries, size
+
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests else 0.0,
+                'entries': self.entries,
+                'bytes': self.size,
+            }
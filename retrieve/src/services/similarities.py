@@ -1,6 +1,6 @@
+import itertools
 import logging
 
-from gensim.models import KeyedVectors
 from sklearn.pipeline import Pipeline
 from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
 
@@ -11,12 +11,20 @@ import numpy as np
 import pickle
 import os
 
-from transformers import AutoTokenizer, AutoConfig, AutoModel
+from services.ann import IVFPQIndex
+from services.encoder import ranking_agreement, sample_queries
+from services.inverted_index import InvertedIndex
+from services.ranking import normalize_rows, top_k
+from services.registry import registry
+from services.store import ArtifactStore
+from services import tracing
 
 logger = logging.getLogger(__name__)
 stop_words = set(hazm.stopwords_list() + ['نمی', 'های'])
 normalizer = hazm.Normalizer(token_based=True)
 
+WORD2VEC = 'resources/farsi_literature_word2vec_model.txt'
+
 
 def batch_series(iterable, n=2_000):
     length = len(iterable)
@@ -25,62 +33,114 @@ def batch_series(iterable, n=2_000):
 
 class Similarities:
 
-    def __init__(self, dataset, checkpoint=None):
+    def __init__(self, dataset, checkpoint=None, store=None, normalized=False):
 
-        dataset['text'] = dataset['text'].apply(normalizer.normalize)
+        if not normalized:
+            dataset['text'] = dataset['text'].apply(normalizer.normalize)
         self.dataset = dataset.sort_values('text')
-        self.word2vec = KeyedVectors.load_word2vec_format('resources/farsi_literature_word2vec_model.txt')
 
-        model_name = 'HooshvareLab/bert-base-parsbert-uncased'
-        self.tokenizer = AutoTokenizer.from_pretrained(model_name, local_files_only=False)
-        self.model = AutoModel.from_pretrained(
-            model_name, local_files_only=False, config=AutoConfig.from_pretrained(model_name))
+        self.directory = checkpoint or 'resources/similarities/'
+        self.store = store or ArtifactStore(self.directory)
 
         if checkpoint and os.path.exists(os.path.join(checkpoint, 'pipeline')):
-
             self.pipe = self.load_model(checkpoint, 'pipeline')
-            self.directory = checkpoint
+
+        elif 'tfidf.vocabulary' in self.store:
+            self.pipe = self.load_pipeline(self.store.load('tfidf.vocabulary'), self.store.load('tfidf.idf'))
 
         else:
             logger.warning('It is not possible to load pipeline. Again the models are trained.')
 
-            self.directory = 'resources/similarities/'
-            if not os.path.exists(self.directory):
-                os.mkdir(self.directory)
-
             self.pipe = Pipeline(
                 [('count',
                   CountVectorizer(analyzer='word', ngram_range=(1, 2), max_features=10_000, stop_words=stop_words)),
                  ('tfidf', TfidfTransformer(sublinear_tf=True))]).fit(self.dataset['text'].tolist())
 
+            self.store.save('tfidf.vocabulary', np.array(self.pipe['count'].get_feature_names_out(), dtype=str))
+            self.store.save('tfidf.idf', self.pipe['tfidf'].idf_)
+
         self.word_idf = dict(zip(self.pipe['count'].get_feature_names_out(), self.pipe['tfidf'].idf_))
 
-        embedders = [
-            self.get_tfidf_embeddings,
-            self.get_boolean_embeddings,
-            self.get_word_cidf_embeddings,
-            self.get_transformer_embeddings,
-        ]
+        # word2vec rows pre-multiplied by idf; the extra last row is the zero vector of unknown words
+        if 'word_cidf.vocabulary' not in self.store:
+            word2vec = registry.word2vec(WORD2VEC)
+            vocabulary = [w for w in word2vec.index_to_key if w in self.word_idf]
+
+            self.store.save('word_cidf.vocabulary', np.array(vocabulary, dtype=str))
+            self.store.save('word_cidf', np.vstack([
+                word2vec[vocabulary] * np.array([self.word_idf[w] for w in vocabulary])[:, None],
+                np.zeros((1, word2vec.vector_size)),
+            ]).astype(np.float32))
+
+        self.word_ids = {w: i for i, w in enumerate(self.store.load('word_cidf.vocabulary').tolist())}
+        self.word_cidf = self.store.load('word_cidf')
+
+        self.indexes = {}
+        for embedder in [self.get_tfidf_embeddings, self.get_boolean_embeddings]:
+            name = self.index_name(embedder)
+
+            if not InvertedIndex.exists(self.store, name):
+                InvertedIndex.from_matrix(embedder(self.dataset['text'].tolist())).save(self.store, name)
+
+            self.indexes[name] = InvertedIndex.load(self.store, name)
+
+        corpus_embedders = {
+            self.get_word_cidf_embeddings.__name__[4:]: self.get_word_cidf_embeddings,
+            self.get_transformer_embeddings.__name__[4:]: registry.encoder().encode,
+        }
+
+        self.embeddings = {}
+        for name, embedder in corpus_embedders.items():
+
+            # rows are stored L2-normalized, so scoring a query is a single matrix-vector product
+            if f'{name}.l2' not in self.store:
+                self.store.save(f'{name}.l2', normalize_rows(np.concatenate([
+                    embedder(batch) for batch in tqdm.tqdm(batch_series(self.dataset['text'].tolist(), 5_000))
+                ])).astype(np.float32))
+
+            self.embeddings[name] = self.store.load(f'{name}.l2')
 
-        for embedder in embedders:
+        self.check_quantized_encoder()
 
-            if any(x.startswith(embedder.__name__[4:]) for x in os.listdir(self.directory)):
-                logger.warning(f'Skip {embedder.__name__[4:]}.')
-                continue
+        self.ann = {}
+        if os.getenv('SENTENCE_ANN', '0') == '1':
+            name = self.get_transformer_embeddings.__name__[4:]
 
-            for i, batch in tqdm.tqdm(enumerate(batch_series(self.dataset['text'].tolist(), 5_000))):
-                embeddings = embedder(batch)
-                self.save_model(embeddings, self.directory, f'{embedder.__name__[4:]}.{i}')
+            if not IVFPQIndex.exists(self.store, f'{name}.ivfpq'):
+                IVFPQIndex.build(self.embeddings[name]).save(self.store, f'{name}.ivfpq')
 
-        self.save_model(self.pipe, self.directory, 'pipeline')
+            self.ann[name] = IVFPQIndex.load(
+                self.store, f'{name}.ivfpq',
+                nprobe=int(os.getenv('ANN_NPROBE', 16)), rerank=int(os.getenv('ANN_RERANK', 16)))
 
     @staticmethod
-    def get_similar_by_cosine_distance(vector, documents, n=5):
+    def get_similar_by_cosine_distance(vector, documents, n=5, normalized=False):
         sq_vector = np.squeeze(vector)
-        similarity = documents.dot(sq_vector) / (np.linalg.norm(documents, axis=1) * np.linalg.norm(sq_vector) + 1e-10)
-        sorted_idx = np.argsort(similarity)[::-1]
+        with tracing.span('score'):
+            if normalized:
+                similarity = documents.dot((sq_vector / (np.linalg.norm(sq_vector) + 1e-10)).astype(documents.dtype))
+            else:
+                similarity = documents.dot(sq_vector) / (
+                        np.linalg.norm(documents, axis=1) * np.linalg.norm(sq_vector) + 1e-10)
 
-        return sorted_idx[:n], similarity[sorted_idx[:n]]
+        with tracing.span('top_k'):
+            sorted_idx = top_k(similarity, n)
+        return sorted_idx, similarity[sorted_idx]
+
+    @staticmethod
+    def index_name(embedder):
+        return embedder.__name__[4:].replace('_embeddings', '_index')
+
+    @staticmethod
+    def load_pipeline(vocabulary, idf):
+        # the fitted vocabulary makes fitting unnecessary, so only the idf weights need restoring
+        count = CountVectorizer(
+            analyzer='word', ngram_range=(1, 2), stop_words=stop_words,
+            vocabulary={term: i for i, term in enumerate(vocabulary.tolist())})
+        tfidf = TfidfTransformer(sublinear_tf=True)
+        tfidf.idf_ = np.asarray(idf)
+
+        return Pipeline([('count', count), ('tfidf', tfidf)])
 
     @staticmethod
     def save_model(obj, directory, file_name):
@@ -93,69 +153,90 @@ class Similarities:
     def load_model(directory, file_name):
         return pickle.load(open(os.path.join(directory, file_name), 'rb'))
 
-    def get_transformer_embeddings(self, documents):
+    def check_quantized_encoder(self):
+        if registry.query_encoder() is registry.encoder():
+            return
+
+        agreement = ranking_agreement(
+            registry.encoder(), registry.query_encoder(), sample_queries(self.dataset['text'].tolist()),
+            self.embeddings[self.get_transformer_embeddings.__name__[4:]])
 
-        result = None
-        for batch in batch_series(documents, 1_000):
-            output = self.model(**self.tokenizer(batch, return_tensors='pt', padding=True))
-            output = np.mean(output.last_hidden_state.detach().numpy(), axis=1)
-            result = output if result is None else np.concatenate((result, output))
+        if agreement < float(os.getenv('QUANTIZED_MIN_AGREEMENT', 0.9)):
+            logger.warning(f'Quantized encoder agrees on {agreement:.2%} of the top results. Fall back to fp32.')
+            registry.reject_quantized()
+            return
 
-        return result
+        logger.info(f'Quantized encoder agrees on {agreement:.2%} of the top results.')
+
+    @staticmethod
+    def get_transformer_embeddings(documents):
+        return registry.query_encoder().encode(documents)
 
     def get_word_cidf_embeddings(self, documents):
-        def embedder(element, word2vec, word_idf):
-            return np.mean(
-                [
-                    (word2vec[w] if w in word2vec else np.zeros(100)) * word_idf.get(w, 0)
-                    for w in hazm.word_tokenize(element)
-                ], axis=0).tolist()
+        unknown = len(self.word_cidf) - 1
+        tokens = [[self.word_ids.get(w, unknown) for w in hazm.word_tokenize(doc)] for doc in documents]
+
+        lengths = np.array([len(ids) for ids in tokens])
+        offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        rows = self.word_cidf[np.fromiter(itertools.chain.from_iterable(tokens), dtype=np.int64)]
+
+        # mean-pool each document's segment of rows; documents without tokens stay zero
+        embeddings = np.zeros((len(documents), self.word_cidf.shape[1]), dtype=np.float32)
+        non_empty = lengths > 0
+        if np.any(non_empty):
+            embeddings[non_empty] = np.add.reduceat(rows, offsets[non_empty]) / lengths[non_empty, None]
 
-        return np.array([embedder(doc, self.word2vec, self.word_idf) for doc in documents])
+        return embeddings
 
     def get_tfidf_embeddings(self, documents):
-        return self.pipe.transform(documents).toarray()
+        return self.pipe.transform(documents)
 
     def get_boolean_embeddings(self, documents):
-        return self.pipe['count'].transform(documents).toarray().astype(bool).astype(int)
+        return self.pipe['count'].transform(documents).astype(bool).astype(np.float32)
+
+    @staticmethod
+    def embed_query(text, embedder):
+        return registry.embed_query(embedder.__name__[4:], text, embedder)
 
     def get_similar_indexes(self, text, n, embedder):
-        embedding = embedder([text])
+        embedding = self.embed_query(text, embedder)
         name = embedder.__name__[4:]
 
-        offset = 0
-
-        indexes, similarities = [], []
-        files = filter(lambda file: file.startswith(name), os.listdir(self.directory))
-        for file_name in sorted(files):
-            batch_embeddings = self.load_model(self.directory, file_name)
-            _idx, _sim = self.get_similar_by_cosine_distance(embedding, batch_embeddings, n)
+        if name in self.ann:
+            with tracing.span('score'):
+                indexes, similarities = self.ann[name].search(
+                    normalize_rows(embedding), n, vectors=self.embeddings[name])
+            if len(indexes) == min(n, len(self.embeddings[name])):
+                return indexes, similarities.reshape(-1, 1)
 
-            similarities.extend(_sim)
-            indexes.extend(_idx + offset)
-            offset = offset + len(batch_embeddings)
+        indexes, similarities = self.get_similar_by_cosine_distance(embedding, self.embeddings[name], n, normalized=True)
+        return indexes, similarities.reshape(-1, 1)
 
-        similarities = np.array(similarities)
-        indexes = np.array(indexes)
+    def get_similar_postings(self, text, n, embedder):
+        embedding = self.embed_query(text, embedder)
+        with tracing.span('score'):
+            indexes, similarities = self.indexes[self.index_name(embedder)].search(embedding, n)
+        return indexes, similarities.reshape(-1, 1)
 
-        sorted_indexes = np.argsort(similarities)[::-1]
-        return indexes[sorted_indexes[:n]], similarities[sorted_indexes[:n]].reshape(-1, 1)
+    def get_documents(self, idx, dist):
+        with tracing.span('documents'):
+            return np.hstack((self.dataset.iloc[idx], dist))
 
     def get_similar_by_tfidf(self, text, n):
-        idx, _dist = self.get_similar_indexes(text, n, self.get_tfidf_embeddings)
-        return np.hstack((self.dataset.iloc[idx], _dist))
+        idx, _dist = self.get_similar_postings(text, n, self.get_tfidf_embeddings)
+        return self.get_documents(idx, _dist)
 
     def get_similar_by_boolean(self, text, n):
-        idx, _dist = self.get_similar_indexes(text, n, self.get_boolean_embeddings)
-        return np.hstack((self.dataset.iloc[idx], _dist))
+        idx, _dist = self.get_similar_postings(text, n, self.get_boolean_embeddings)
+        return self.get_documents(idx, _dist)
 
     def get_similar_by_word_embedding(self, text, n):
         idx, _dist = self.get_similar_indexes(text, n, self.get_word_cidf_embeddings)
-        return np.hstack((self.dataset.iloc[idx], _dist))
+        return self.get_documents(idx, _dist)
 
     def get_similar_by_sentence_embedding(self, text, n):
         idx, _dist = self.get_similar_indexes(text, n, self.get_transformer_embeddings)
-        return np.hstack((self.dataset.iloc[idx], _dist))
+        return self.get_documents(idx, _dist)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,223 @@
+import functools
+import logging
+import os
+from collections import Counter
+
+import hazm
+import numpy as np
+
+from services.store import StoredArrays
+
+logger = logging.getLogger(__name__)
+normalizer = hazm.Normalizer(token_based=True)
+
+# letters readers commonly type for one another; swapping two of the same group costs half an edit
+CONFUSABLE = ['سصث', 'زذضظ', 'تط', 'هح', 'اآ', 'یيئ', 'کكگ', 'قغ']
+CONFUSABLE_PAIRS = {(a, b) for group in CONFUSABLE for a in group for b in group if a != b}
+
+# deletes are taken after folding each group into one letter, so confusions never use up the delete budget
+FOLD = str.maketrans({ch: group[0] for group in CONFUSABLE for ch in group})
+
+
+def fuzziness(word):
+    # the same edit budget as elasticsearch's AUTO fuzziness
+    return 0 if len(word) <= 2 else 1 if len(word) <= 5 else 2
+
+
+def deletes(word, distance):
+    found, frontier = {word}, {word}
+    for _ in range(distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        found |= frontier
+
+    return found
+
+
+def edit_distance(a, b, limit=None):
+    # optimal string alignment distance, with cheaper substitutions between confusable letters; with a limit only
+    # the diagonal band the limit allows is filled, and anything further than the limit comes back as limit + 1
+    band = int(limit) if limit is not None else max(len(a), len(b))
+    far = band + 1
+    if abs(len(a) - len(b)) > band:
+        return far
+
+    before, previous = None, [j if j <= band else far for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        x = a[i - 1]
+        current = [i if i <= band else far] + [far] * len(b)
+        for j in range(max(1, i - band), min(len(b), i + band) + 1):
+            y = b[j - 1]
+            if x == y:
+                cost = previous[j - 1]
+            else:
+                cost = min(previous[j - 1] + (0.5 if (x, y) in CONFUSABLE_PAIRS else 1),
+                           previous[j] + 1, current[j - 1] + 1)
+                if i > 1 and j > 1 and x == b[j - 2] and a[i - 2] == y:
+                    cost = min(cost, before[j - 2] + 1)
+            current[j] = cost
+
+        if min(current) > band:
+            return far
+        before, previous = previous, current
+
+    return min(previous[-1], far)
+
+
+def adjacent_words(texts):
+    # neighbours within a mesra, the two halves of a beyt are not read as one sentence
+    for text in texts:
+        for mesra in text.split('-'):
+            words = mesra.split()
+            yield from zip(words, words[1:])
+
+
+def confidences(scores, temperature=1.0, outside=-1.5):
+    # a softmax over the beam that keeps exp(outside) for the intended query not being in it at all,
+    # relative to the best rewrite, e.g. when one of its words had no candidate
+    scores = np.asarray(scores, dtype=np.float64)
+    weights = np.exp((scores - scores.max()) / temperature)
+    return weights / (weights.sum() + np.exp(outside))
+
+
+class SpellingIndex(StoredArrays):
+    # symmetric delete dictionary: every word is filed under each string it becomes after up to max_distance deletes,
+    # so a lookup only has to generate the deletes of the query word and verify the words filed under them;
+    # bigrams are kept as sorted (left id * vocabulary size + right id) keys for rescoring whole queries
+    fields = ['words', 'counts', 'deletes', 'indptr', 'indices', 'bigrams', 'bigram_counts']
+
+    def __init__(self, words, counts, deletes, indptr, indices, bigrams, bigram_counts):
+        self.words = words
+        self.counts = counts
+        self.deletes = deletes
+        self.indptr = indptr
+        self.indices = indices
+        self.bigrams = bigrams
+        self.bigram_counts = bigram_counts
+
+        self.vocabulary = words.tolist()
+        self.ids = {word: i for i, word in enumerate(self.vocabulary)}
+        self.lengths = np.char.str_len(words)
+        self.offsets = {key: i for i, key in enumerate(deletes.tolist())}
+        self.candidates = functools.lru_cache(maxsize=int(os.getenv('SPELLING_CACHE_SIZE', 16_384)))(self.lookup)
+
+    @classmethod
+    def from_texts(cls, texts, max_distance=2):
+        counts = Counter(word for text in texts for word in text.replace('-', ' ').split())
+        words = sorted(counts)
+
+        pairs = sorted((key, i) for i, word in enumerate(words) for key in deletes(word.translate(FOLD), max_distance))
+        keys, starts = np.unique(np.array([key for key, _ in pairs], dtype=str), return_index=True)
+
+        ids = {word: i for i, word in enumerate(words)}
+        bigrams = Counter(ids[a] * len(words) + ids[b] for a, b in adjacent_words(texts))
+        bigram_keys = np.array(sorted(bigrams), dtype=np.int64)
+        logger.info(f'Built a spelling index of {len(words)} words, {len(keys)} deletes and {len(bigrams)} bigrams.')
+
+        return cls(
+            np.array(words, dtype=str),
+            np.array([counts[word] for word in words], dtype=np.int64),
+            keys,
+            np.append(starts, len(pairs)).astype(np.int64),
+            np.array([i for _, i in pairs], dtype=np.int32),
+            bigram_keys,
+            np.array([bigrams[key] for key in bigram_keys.tolist()], dtype=np.int64),
+        )
+
+    @classmethod
+    def load_or_build(cls, store, texts, name='spelling'):
+        if cls.exists(store, name):
+            return cls.load(store, name)
+
+        index = cls.from_texts(texts)
+        index.save(store, name)
+        return index
+
+    def __len__(self):
+        return len(self.words)
+
+    def lookup(self, word, n=5):
+        # (word, distance, count) of the closest vocabulary words, nearer and then more frequent ones first
+        # nothing beats a word of the vocabulary itself
+        if n == 1 and word in self.ids:
+            return (word, 0, int(self.counts[self.ids[word]])),
+
+        distance = fuzziness(word)
+        keys = deletes(word.translate(FOLD), distance)
+        filed = [(len(key), self.offsets[key]) for key in keys if key in self.offsets]
+        if not filed:
+            return ()
+
+        # a word within the budget shares a key with the query that is at most that many deletes away from both;
+        # the longest shared key also bounds the distance from below, so the loop can stop early
+        lengths, starts = np.array(filed).T
+        sizes = self.indptr[starts + 1] - self.indptr[starts]
+        offsets = np.repeat(self.indptr[starts] - np.cumsum(sizes) + sizes, sizes) + np.arange(sizes.sum())
+        ids = self.indices[offsets]
+        bounds = np.maximum(self.lengths[ids], len(word)) - np.repeat(lengths, sizes)
+        ids, bounds = ids[bounds <= distance], bounds[bounds <= distance]
+
+        order = np.lexsort((ids, -self.counts[ids], bounds))
+        ids, bounds = ids[order], bounds[order]
+        first = np.sort(np.unique(ids, return_index=True)[1])
+
+        candidates = []
+        for i, bound in zip(ids[first].tolist(), bounds[first].tolist()):
+            if len(candidates) >= n and bound > candidates[n - 1][1]:
+                break
+
+            d = edit_distance(word, self.vocabulary[i], distance)
+            if d <= distance:
+                candidates.append((self.vocabulary[i], d, int(self.counts[i])))
+                candidates.sort(key=lambda c: (c[1], -c[2], c[0]))
+
+        return tuple(candidates[:n])
+
+    def bigram_count(self, keys):
+        if not len(self.bigrams):
+            return np.zeros(keys.shape)
+
+        positions = np.minimum(np.searchsorted(self.bigrams, keys), len(self.bigrams) - 1)
+        return np.where(self.bigrams[positions] == keys, self.bigram_counts[positions], 0)
+
+    def rewrites(self, query, beam=8, candidates=5, edit_weight=4.0, smoothing=50.0):
+        # beam search over the candidates of every word; a rewrite scores the log probability of its words under a
+        # bigram model smoothed towards unigram frequencies, minus edit_weight for every unit of edit distance;
+        # a word with no candidate is kept as it is, and when no word has one there is nothing to rank
+        size = len(self.vocabulary)
+        total = self.counts.sum() + size
+        beams = [((), 0.0)]
+        known = False
+
+        for word in normalizer.normalize(query).split():
+            options = self.candidates(word, candidates)
+            if not options:
+                # an unseen word takes the add-one unigram mass, the same for every beam, and gives no bigram context
+                beams = [(words + (word,), score - np.log(total)) for words, score in beams]
+                continue
+
+            ids = np.array([self.ids[candidate] for candidate, _, _ in options])
+            distances = np.array([distance for _, distance, _ in options])
+            unigram = (self.counts[ids] + 1) / total
+
+            if beams[0][0] and not isinstance(beams[0][0][-1], str):
+                previous = np.array([words[-1] for words, _ in beams])
+                pairs = self.bigram_count(previous[:, None] * size + ids[None, :])
+                log_probability = np.log((pairs + smoothing * unigram) / (self.counts[previous][:, None] + smoothing))
+            else:
+                log_probability = np.log(unigram)[None, :]
+
+            scores = np.array([score for _, score in beams])[:, None] + log_probability - edit_weight * distances
+            best = np.argsort(-scores, axis=None, kind='stable')[:beam]
+            beams = [(beams[row][0] + (int(ids[col]),), float(scores[row, col]))
+                     for row, col in zip(*np.unravel_index(best, scores.shape))]
+            known = True
+
+        if not known:
+            return []
+
+        return [(' '.join(i if isinstance(i, str) else self.vocabulary[i] for i in words), score)
+                for words, score in beams]
+
+    def correct(self, word):
+        candidates = self.candidates(word, 1)
+        return candidates[0][0] if candidates else None
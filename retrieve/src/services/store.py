@@ -0,0 +1,59 @@
+import os
+
+import numpy as np
+
+
+class ArtifactStore:
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.arrays = {}
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, f'{name}.npy')
+
+    def __contains__(self, name):
+        return os.path.exists(self.path(name))
+
+    def save(self, name, array):
+        # written next to the target and renamed, so readers never map a half-written file
+        tmp_path = f'{self.path(name)}.tmp'
+        with open(tmp_path, 'wb') as file:
+            np.save(file, np.ascontiguousarray(array))
+
+        os.replace(tmp_path, self.path(name))
+        self.arrays.pop(name, None)
+
+    def load(self, name):
+        if name not in self.arrays:
+            self.arrays[name] = np.load(self.path(name), mmap_mode='r')
+
+        return self.arrays[name]
+
+
+class StoredArrays:
+    # a class made of the arrays in `fields`, kept in a store as '<name>.<field>'
+    fields = []
+
+    @classmethod
+    def exists(cls, store, name):
+        return all(f'{name}.{field}' in store for field in cls.fields)
+
+    @classmethod
+    def load_arrays(cls, store, name):
+        return [store.load(f'{name}.{field}') for field in cls.fields]
+
+    @classmethod
+    def save_arrays(cls, store, name, arrays):
+        for field, array in zip(cls.fields, arrays):
+            store.save(f'{name}.{field}', array)
+
+    @classmethod
+    def load(cls, store, name, **kwargs):
+        return cls(*cls.load_arrays(store, name), **kwargs)
+
+    def save(self, store, name):
+        self.save_arrays(store, name, [getattr(self, field) for field in self.fields])
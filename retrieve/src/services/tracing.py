@@ -0,0 +1,92 @@
+import contextlib
+import contextvars
+import cProfile
+import itertools
+import os
+import pstats
+import threading
+import time
+
+current_trace = contextvars.ContextVar('current_trace', default=None)
+current_stage = contextvars.ContextVar('current_stage', default='request')
+dump_ids = itertools.count()
+
+
+class Trace:
+
+    def __init__(self, profile=False):
+        self.start = time.perf_counter()
+        self.spans = []
+        self.profile = profile
+        self.profiles = []
+        self.lock = threading.Lock()
+
+    @property
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.start) * 1e3
+
+    def add(self, stage, name, start, end):
+        with self.lock:
+            self.spans.append((stage, name, (start - self.start) * 1e3, (end - start) * 1e3))
+
+    def stage_spans(self, stage):
+        with self.lock:
+            return [s for s in self.spans if s[0] == stage]
+
+    def dump_profile(self, directory):
+        # each stage ran in its own executor thread under its own profiler, so they are merged here
+        with self.lock:
+            profiles = list(self.profiles)
+        if not profiles:
+            return None
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        path = os.path.join(directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{next(dump_ids)}.prof')
+        pstats.Stats(*profiles).dump_stats(path)
+        return path
+
+
+@contextlib.contextmanager
+def active(trace):
+    token = current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        current_trace.reset(token)
+
+
+@contextlib.contextmanager
+def span(name):
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(current_stage.get(), name, start, time.perf_counter())
+
+
+@contextlib.contextmanager
+def stage(name, profile=True):
+    # profile=False for stages awaited on the event loop, where a profiler would also see every other task
+    token = current_stage.set(name)
+    trace = current_trace.get()
+    profiler = cProfile.Profile() if profile and trace is not None and trace.profile else None
+
+    if profiler:
+        profiler.enable()
+    try:
+        with span('total'):
+            yield
+    finally:
+        if profiler:
+            profiler.disable()
+            with trace.lock:
+                trace.profiles.append(profiler)
+
+        current_stage.reset(token)